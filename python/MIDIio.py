@@ -1,9 +1,12 @@
-import rtmidi
-import time
+import time, threading, heapq
+from collections import deque
 
 from MIDIConstants import *
 from constants import *
 import config
+from profiling import profiler, Now
+from midisched import MIDIScheduler
+from midibackend import GetBackend
 
 def IfConnected (midiFn):
 	''' Just ignore MIDI calls if the interface isn't up. '''
@@ -13,9 +16,74 @@ def IfConnected (midiFn):
 		midiFn (self, *args, **kwargs)
 	return MIDIFunction
 
+def RunningStatus (messages):
+	''' Concatenates channel messages into one byte stream, leaving out status
+	bytes that repeat the previous message's. '''
+	stream = []
+	status = None
+	for message in messages:
+		if message[0] == status:
+			stream.extend (message[1:])
+		else:
+			stream.extend (message)
+			status = message[0] if message[0] < 0xF0 else None
+	return stream
+
+def IsNoteOff (message):
+	status = message[0] & 0xF0
+	return status == NOTE_OFF or (status == NOTE_ON and message[2] == 0)
+
+class NoteTable:
+	''' Notes held until a release time, indexed by (channel, note) for
+	lookup and cancellation and by a min-heap of release times so that
+	expiring notes costs O(expired) rather than O(held).
+
+	Removing or re-adding a note leaves its old heap entry in place, marked
+	dead, to be discarded when it reaches the top. '''
+	def __init__ (self):
+		self.heap = []
+		self.notes = {} # (channel, note) -> [release, key, alive]
+
+	def __len__ (self):
+		return len (self.notes)
+
+	def __contains__ (self, key):
+		return key in self.notes
+
+	def Add (self, channel, note, release):
+		key = (channel, note)
+		previous = self.notes.get (key)
+		if previous != None: previous[2] = False
+		entry = self.notes[key] = [release, key, True]
+		heapq.heappush (self.heap, entry)
+
+	def Remove (self, channel, note):
+		''' Forgets a note. Returns True if it was held. '''
+		entry = self.notes.pop ((channel, note), None)
+		if entry == None: return False
+		entry[2] = False
+		return True
+
+	def Expire (self, now):
+		''' Removes and returns the (channel, note) keys of notes due for
+		release by time now, earliest first. '''
+		expired = []
+		heap = self.heap
+		while len(heap) > 0 and heap[0][0] <= now:
+			release, key, alive = heapq.heappop (heap)
+			if alive:
+				del self.notes[key]
+				expired.append (key)
+		return expired
+
+	def Clear (self):
+		''' Removes and returns the keys of all held notes. '''
+		keys = [entry[1] for entry in sorted (self.notes.values ())]
+		self.heap = []
+		self.notes = {}
+		return keys
+
 class MIDIDevice:
-	inPorts = [str(portName) for portName in rtmidi.MidiIn().get_ports ()]
-	outPorts = [str(portName) for portName in rtmidi.MidiOut().get_ports ()]
 	MODE_INPUT = 0
 	MODE_OUTPUT = 1
 
@@ -23,17 +91,55 @@ class MIDIDevice:
 	STATE_CONNECTED = 1
 	STATE_ERROR = 2
 
-	def __init__ (self, mode=MODE_INPUT):
-		self.activeNotes = []
+	# Kinds of continuously updated value, see SetValue
+	VALUE_CONTROL = 0
+	VALUE_CONTROL_14BIT = 1
+	VALUE_PITCH_BEND = 2
+
+	def __init__ (self, mode=MODE_INPUT, useCallback=config.MIDI_INPUT_CALLBACK, immediate=config.MIDI_INPUT_IMMEDIATE_TYPES, scheduled=config.MIDI_OUTPUT_SCHEDULER, batched=config.MIDI_OUTPUT_BATCHED, backend=None):
+		# See midibackend.py
+		self.backend = backend if backend != None else GetBackend ()
+		self.activeNotes = NoteTable ()
+		# Controller output cache for SetControl and friends:
+		# (kind, channel, controller) -> [last value sent, time sent], plus
+		# values held back by rate limiting.
+		self.controls = {}
+		self.heldControls = {}
+		self.controlInterval = config.MIDI_CC_MIN_INTERVAL
+		# Callback-driven input: messages are timestamped as they arrive on
+		# the backend's thread and either handled there, if their type
+		# (status without channel) is immediate, or queued for the main
+		# loop. Appending to and popping from a deque is atomic.
+		self.useCallback = useCallback
+		self.immediate = frozenset (immediate)
+		self.inputQueue = deque ()
+		# Colour range changes, as (colour range, field, change), waiting
+		# for the main loop
+		self.rangeChanges = deque ()
 		self.tracker = None
 		self.deviceID = None
 		self.mode = mode
 		self.state = MIDIDevice.STATE_NOTCONNECTED
+		self.scheduler = None
 		if mode == MIDIDevice.MODE_OUTPUT:
-			self.device = rtmidi.MidiOut ()
+			self.device = self.backend.NewOutput ()
 			self.Tick = self.TickOutput
+			# The scheduler thread and the main loop both send, so sends are
+			# serialised.
+			self.sendLock = threading.Lock ()
+			# Messages from the main loop are collected here and sent
+			# together by TickOutput.
+			self.batched = batched
+			self.runningStatus = config.MIDI_RUNNING_STATUS
+			self.outBuffer = []
+			# An SMFRecorder, or anything else with Put (message, time),
+			# is given every message sent.
+			self.recorder = None
+			if scheduled:
+				self.scheduler = MIDIScheduler (self.SendNow)
+				self.scheduler.Start ()
 		elif mode == MIDIDevice.MODE_INPUT:
-			self.device = rtmidi.MidiIn ()
+			self.device = self.backend.NewInput ()
 			self.Tick = self.TickInput
 
 	def OpenPort (self, portID):
@@ -51,27 +157,81 @@ class MIDIDevice:
 		except:
 			self.state = MIDIDevice.STATE_ERROR
 			return False
+		if self.mode == MIDIDevice.MODE_INPUT and self.useCallback:
+			self.device.set_callback (self.OnMessage)
 		self.state = MIDIDevice.STATE_CONNECTED
 		return True
 
+	def GetInputPorts (self):
+		return self.backend.InputPorts ()
+
+	def GetOutputPorts (self):
+		return self.backend.OutputPorts ()
+
 	def PrepareOpenInputPort (self, portID):
-		if portID >= len(MIDIDevice.inPorts):
+		if portID >= len(self.GetInputPorts ()):
 			self.state = MIDIDevice.STATE_ERROR
 			return False
 		return True
 
 	def PrepareOpenOutputPort (self, portID):
-		if portID >= len(MIDIDevice.outPorts):
+		if portID >= len(self.GetOutputPorts ()):
 			self.state = MIDIDevice.STATE_ERROR
 			return False
 		self.CancelActiveNotes ()
+		# A different device may be listening; resend every controller.
+		self.controls = {}
+		self.heldControls = {}
 		return True
 
 	@IfConnected
 	def CancelActiveNotes (self):
-		for note in self.activeNotes[:]:
-			self.device.send_message ([note[0], note[1], 0])
-			self.activeNotes.remove (note)
+		for channel, note in self.activeNotes.Clear ():
+			self.Send ([channel, note, 0])
+		self.FlushOutput ()
+		# Release scheduled notes now; drop anything else that was pending.
+		if self.scheduler != None: self.scheduler.Flush (keep=IsNoteOff)
+
+	def Close (self):
+		''' Releases held notes, stops the output scheduler and closes the
+		port. '''
+		if self.mode == MIDIDevice.MODE_OUTPUT:
+			self.CancelActiveNotes ()
+			if self.scheduler != None: self.scheduler.Stop ()
+		if self.state == MIDIDevice.STATE_CONNECTED:
+			self.device.close_port ()
+		self.state = MIDIDevice.STATE_NOTCONNECTED
+
+	def Send (self, message):
+		''' Sends a raw message, or adds it to the output buffer if sending is
+		batched. Main loop only. '''
+		if self.batched: self.outBuffer.append (message)
+		else: self.SendNow (message)
+
+	def SendNow (self, message):
+		''' Sends a raw message. Safe to call from the scheduler thread. '''
+		with self.sendLock:
+			if self.state == MIDIDevice.STATE_CONNECTED:
+				self.device.send_message (message)
+				if self.recorder != None: self.recorder.Put (message, Now ())
+
+	def FlushOutput (self):
+		''' Sends the contents of the output buffer. With runningStatus set
+		the buffer goes out as a single running-status byte stream, which
+		only suits outputs that accept several messages at once. '''
+		if len(self.outBuffer) == 0: return
+		messages = self.outBuffer
+		self.outBuffer = []
+		with self.sendLock:
+			if self.state != MIDIDevice.STATE_CONNECTED: return
+			if self.runningStatus:
+				self.device.send_message (RunningStatus (messages))
+			else:
+				send = self.device.send_message
+				for message in messages: send (message)
+			if self.recorder != None:
+				now = Now ()
+				for message in messages: self.recorder.Put (message, now)
 
 	'''def OpenInputPort (self, portID):
 		self.deviceID = portID
@@ -80,49 +240,183 @@ class MIDIDevice:
 
 	@IfConnected
 	def SendNote (self, note, velocity, duration, channel=0x99):
-		self.device.send_message ([channel, note, velocity])
-		self.activeNotes.append ([channel, note, velocity, duration, time.time ()])
+		self.NoteOn (note, velocity, channel)
+		if self.scheduler != None:
+			self.NoteOff (note, channel, at=Now () + duration)
+		else:
+			self.activeNotes.Add (channel, note, time.time () + duration)
 
 	@IfConnected
-	def NoteOn (self, note, velocity, channel=1):
-		self.device.send_message ([channel, note, velocity])
+	def NoteOn (self, note, velocity, channel=1, at=None):
+		''' Sends a note-on now, or at time at (see profiling.Now) if the
+		output scheduler is running. Until then, a note-off sent now cancels
+		it, as does a later note-on for the same note. '''
+		if self.scheduler != None and at != None:
+			self.FlushNote (channel, note)
+			if self.ForgetNote (channel, note): self.scheduler.Schedule (at, [channel, note, 0])
+			self.scheduler.Schedule (at, [channel, note, velocity], key=(channel, note, NOTE_ON))
+			return
+		# Retriggering a held note steals it: release it first, and drop its
+		# pending note-off so that it can't cut the new note short.
+		if self.ForgetNote (channel, note): self.Send ([channel, note, 0])
+		self.Send ([channel, note, velocity])
 
 	@IfConnected
-	def NoteOff (self, note, channel=1):
-		self.device.send_message ([channel, note, 0])
+	def NoteOff (self, note, channel=1, at=None):
+		if self.scheduler != None and at != None:
+			self.FlushNote (channel, note)
+			self.scheduler.Schedule (at, [channel, note, 0], key=(channel, note))
+			return
+		self.ForgetNote (channel, note)
+		# A note still waiting to start mustn't sound after its note-off.
+		if self.scheduler != None: self.scheduler.Cancel ((channel, note, NOTE_ON))
+		self.Send ([channel, note, 0])
+
+	def FlushNote (self, channel, note):
+		''' Sends the output buffer if it holds a message for the note, so
+		that one scheduled for it, e.g.: the note-off of a short note, can't
+		go out first. '''
+		for message in self.outBuffer:
+			if message[0] == channel and message[1] == note:
+				self.FlushOutput ()
+				return
+
+	def ForgetNote (self, channel, note):
+		''' Drops any pending release of a note. Returns True if the note was
+		being held for release. '''
+		held = self.activeNotes.Remove (channel, note)
+		if self.scheduler != None:
+			held = self.scheduler.Cancel ((channel, note)) or held
+		return held
 
 	@IfConnected
-	def SendControl (self, value, controller=MODULATION_WHEEL, channel=1):
+	def SendControl (self, value, controller=MODULATION_WHEEL, channel=1, at=None):
 		msg = [CONTINUOUS_CONTROLLER + channel - 1, controller, value]
-		self.device.send_message (msg)
+		if self.scheduler != None and at != None:
+			self.scheduler.Schedule (at, msg)
+			return
+		self.Send (msg)
+
+	@IfConnected
+	def SendPitchBend (self, value, channel=1):
+		''' Sends a 14-bit pitch bend, 0-16383 with 8192 as centre. '''
+		self.Send ([PITCH_BEND + channel - 1, value & 0x7F, value >> 7])
+
+	def SetControl (self, value, controller=MODULATION_WHEEL, channel=1):
+		''' Like SendControl, but for continuously updated values: a value
+		the controller already has isn't resent, and each controller is sent
+		at most once per controlInterval. Values arriving sooner are held,
+		the latest replacing any before it, and sent by TickOutput. '''
+		self.SetValue ((MIDIDevice.VALUE_CONTROL, channel, controller), value)
+
+	def SetControl14 (self, value, controller=MODULATION_WHEEL, channel=1):
+		''' SetControl for a 14-bit value, 0-16383, sent as an MSB on
+		controller (0-31) and an LSB on controller+32. The MSB is only sent
+		when it changes. '''
+		self.SetValue ((MIDIDevice.VALUE_CONTROL_14BIT, channel, controller), value)
+
+	def SetPitchBend (self, value, channel=1):
+		''' SetControl for the pitch bend of a channel. '''
+		self.SetValue ((MIDIDevice.VALUE_PITCH_BEND, channel, None), value)
+
+	def SetValue (self, key, value):
+		state = self.controls.get (key)
+		if state == None: state = self.controls[key] = [None, float('-inf')]
+		if value == state[0]:
+			self.heldControls.pop (key, None)
+			return
+		now = Now ()
+		if now - state[1] < self.controlInterval:
+			self.heldControls[key] = value
+			return
+		self.heldControls.pop (key, None)
+		self.SendValue (key, value, state[0])
+		state[0] = value
+		state[1] = now
+
+	def SendValue (self, key, value, previous):
+		kind, channel, controller = key
+		if kind == MIDIDevice.VALUE_CONTROL:
+			self.SendControl (value, controller=controller, channel=channel)
+		elif kind == MIDIDevice.VALUE_CONTROL_14BIT:
+			msb = value >> 7
+			if previous == None or previous >> 7 != msb:
+				self.SendControl (msb, controller=controller, channel=channel)
+			self.SendControl (value & 0x7F, controller=controller+32, channel=channel)
+		elif kind == MIDIDevice.VALUE_PITCH_BEND:
+			self.SendPitchBend (value, channel=channel)
+
+	def FlushControls (self):
+		''' Sends held controller values whose interval is up. '''
+		now = Now ()
+		for key, value in self.heldControls.items ():
+			state = self.controls[key]
+			if now - state[1] < self.controlInterval: continue
+			del self.heldControls[key]
+			self.SendValue (key, value, state[0])
+			state[0] = value
+			state[1] = now
 
 	def SetTracker (self, tracker):
 		self.tracker = tracker
 
 	@IfConnected
 	def TickOutput (self):
-		now = time.time ()
-		for note in self.activeNotes[:]:
-			if now - note[4] >= note[3]:
-				self.device.send_message ([note[0], note[1], 0])
-				self.activeNotes.remove (note)
+		for channel, note in self.activeNotes.Expire (time.time ()):
+			self.Send ([channel, note, 0])
+		if len(self.heldControls) > 0: self.FlushControls ()
+		self.FlushOutput ()
+
+	def OnMessage (self, event, data=None):
+		''' Called by the backend, possibly on a thread of its own, for each
+		incoming message. '''
+		message, delta = event
+		if message[0] & 0xF0 in self.immediate:
+			self.HandleMessage (message)
+		else:
+			self.inputQueue.append ((Now (), message))
 
 	@IfConnected
 	def TickInput (self):
-		msg = self.device.get_message ()
-		markers = self.tracker.markers
-		while msg != None:
-			# this is all specific to my axiom 25...
-			if msg[0][0] == 176:
-				# A knob
-				knobID = msg[0][1] - 102
-				direction = msg[0][2] - 64
-				if knobID==0: markers[MARKER_BLUE].colourRange.saturation[0] += direction
-				if knobID==1: markers[MARKER_BLUE].colourRange.value[0] += direction
-				if knobID==2: markers[MARKER_RED].colourRange.saturation[0] += direction
-				if knobID==3: markers[MARKER_RED].colourRange.value[0] += direction
-				if knobID==4: markers[MARKER_GREEN].colourRange.saturation[0] += direction
-				if knobID==5: markers[MARKER_GREEN].colourRange.value[0] += direction
-				if knobID==6: markers[MARKER_YELLOW].colourRange.saturation[0] += direction
-				if knobID==7: markers[MARKER_YELLOW].colourRange.value[0] += direction
+		if self.useCallback:
+			# Apply everything that arrived since the last tick.
+			while True:
+				try:
+					arrived, message = self.inputQueue.popleft ()
+				except IndexError:
+					break
+				if profiler.enabled: profiler.Record ("midi in.latency", arrived, Now ())
+				self.HandleMessage (message)
+		else:
 			msg = self.device.get_message ()
+			while msg != None:
+				self.HandleMessage (msg[0])
+				msg = self.device.get_message ()
+		self.ApplyRangeChanges ()
+
+	def ApplyRangeChanges (self):
+		''' Applies the colour range changes made by input since the last
+		tick. Main loop only. '''
+		while True:
+			try:
+				colourRange, field, change = self.rangeChanges.popleft ()
+			except IndexError:
+				break
+			getattr (colourRange, field)[0] += change
+
+	def HandleMessage (self, message):
+		''' Handles an incoming message, on the backend's thread if its type
+		is immediate. '''
+		if self.tracker == None: return
+		markers = self.tracker.markers
+		# this is all specific to my axiom 25...
+		if message[0] == 176:
+			# A knob
+			knobID = message[1] - 102
+			direction = message[2] - 64
+			if knobID < 0 or knobID > 7: return
+			marker = markers[(MARKER_BLUE, MARKER_RED, MARKER_GREEN, MARKER_YELLOW)[knobID/2]]
+			field = ("saturation", "value")[knobID%2]
+			# Image processing reads colour ranges on the main loop, so they're
+			# changed there, by ApplyRangeChanges.
+			self.rangeChanges.append ((marker.colourRange, field, direction))
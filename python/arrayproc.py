@@ -0,0 +1,212 @@
+''' arrayproc.py - NumPy-backed image processing using the cv2 API.
+
+ArrayStreamProcessor does the same job as imgproc.StreamProcessor but keeps
+every frame in a preallocated numpy array and passes it as the dst= argument
+of each cv2 call, so the per-frame path doesn't create any image buffers or
+cv header objects. Detection can be driven without a capture device by
+handing ProcessFrame a synthetic BGR frame.
+'''
+
+import cv, cv2, os
+import numpy as np
+
+from imgproc import StreamProcessor, HSVClassifier, ImageSequence, MarkerNotFound, IsVideoFile, FindBlobs
+from constants import *
+from config import *
+
+def InRangeBounds (lower, upper):
+	''' Converts cv.InRangeS style bounds (upper exclusive, possibly
+	fractional) to the inclusive integer bounds used by cv2.inRange. '''
+	return (int(np.ceil (lower)), int(np.ceil (upper)) - 1)
+
+class ArrayStreamProcessor (StreamProcessor):
+	def AllocateFrames (self):
+		w, h = GRID_SIZE
+		self.gridFrame = np.zeros ((h,w,3), dtype=np.uint8)
+		self.gridFrameHSV = np.zeros ((h,w,3), dtype=np.uint8)
+		self.gridMasked = np.zeros ((h,w,4), dtype=np.uint8)
+
+		# Mask frames
+		self.colourMaskTemp = np.zeros ((h,w), dtype=np.uint8)
+		self.colourMaskAll = np.zeros ((h,w), dtype=np.uint8)
+		# Markers sharing a colour range, i.e.: clones, share a mask.
+		rangeMasks = {}
+		self.colourMask = []
+		for marker in self.tracker.markers:
+			key = id (marker.colourRange)
+			if not key in rangeMasks: rangeMasks[key] = np.zeros ((h,w), dtype=np.uint8)
+			self.colourMask.append (rangeMasks[key])
+		self.extractedColours = np.zeros ((h,w,3), dtype=np.uint8)
+		self.erodedMask = np.zeros ((h,w), dtype=np.uint8)
+		self.blobScratch = np.zeros ((h,w), dtype=np.uint8)
+		self.origFrame = None
+		self.captureFrame = None
+
+		self.fineErosion = np.ones ((2,2), dtype=np.uint8)
+		self.erosionAnchor = (0,0)
+
+		self.classifier = None
+		if HSV_CLASSIFIER_LUT:
+			self.classifier = HSVClassifier (GRID_SIZE, len(self.tracker.markers))
+
+		# cv headers onto the output frames, for the UI.
+		self.gridFrameMat = cv.fromarray (self.gridFrame)
+		self.gridMaskedMat = cv.fromarray (self.gridMasked)
+
+	def ReadFrame (self, buf):
+		if isinstance (self.capture, ImageSequence):
+			captureTime = self.CaptureTime ()
+			ok, self.captureFrame = self.capture.read (self.captureFrame)
+		else:
+			ok = self.capture.grab ()
+			captureTime = self.CaptureTime ()
+			if ok: ok, self.captureFrame = self.capture.retrieve (self.captureFrame)
+		if not ok:
+			if IsVideoFile (self.deviceID): self.endOfStream = True
+			return None
+		cv2.flip (self.captureFrame, -1, buf)
+		return captureTime
+
+	def ProcessFrame (self, frame=None, frameTime=None):
+		''' Runs marker detection on frame, a BGR uint8 array of any size
+		captured at frameTime, or on origFrame if no frame is given. '''
+		if frame is None: frame = self.origFrame
+		else: self.frameTime = frameTime
+		cv2.resize (frame, tuple(GRID_SIZE), self.gridFrame)
+		cv2.cvtColor (self.gridFrame, cv2.COLOR_BGR2HSV, self.gridFrameHSV)
+
+		self.colourMaskAll.fill (0)
+		self.extractedColours.fill (0)
+		markers = self.tracker.markers
+		if self.classifier != None:
+			self.classifier.Update ([marker.colourRange for marker in markers])
+			self.classifier.Classify (self.gridFrameHSV, self.colourMask)
+		for group in self.GroupMarkers ():
+			i, marker = group[0]
+			cRange = marker.colourRange
+			mask = self.colourMask[i]
+			if self.classifier == None:
+				hue = InRangeBounds (*cRange.hue)
+				sat = InRangeBounds (*cRange.saturation)
+				val = InRangeBounds (*cRange.value)
+				cv2.inRange (self.gridFrameHSV,
+					(hue[0],sat[0],val[0]), (hue[1],sat[1],val[1]), mask)
+				if cRange.hue2 != None:
+					hue2 = InRangeBounds (*cRange.hue2)
+					cv2.inRange (self.gridFrameHSV,
+						(hue2[0],sat[0],val[0]), (hue2[1],sat[1],val[1]),
+						self.colourMaskTemp)
+					cv2.bitwise_or (self.colourMaskTemp, mask, mask)
+
+			if len (group) > 1:
+				self.LocateBlobs (group)
+				continue
+
+			# First pass: find approximate center to within ROI_SIZE pixels
+			cv2.erode (mask, self.fineErosion, self.erodedMask,
+				self.erosionAnchor, 4)
+			try:
+				x,y,px,py = self.FindCentre (self.erodedMask)
+			except MarkerNotFound:
+				marker.Disable ()
+				continue
+
+			# Second pass: discard outliers and recalculate centre
+			left = max (0, int(px - ROI_SIZE/2))
+			top = max (0, int(py - ROI_SIZE/2))
+			right = min (GRID_SIZE[0], left+ROI_SIZE)
+			bottom = min (GRID_SIZE[1], top+ROI_SIZE)
+			roi = mask[top:bottom, left:right]
+			cv2.erode (roi, self.fineErosion, roi, self.erosionAnchor, 3)
+			cv2.dilate (roi, self.fineErosion, roi, self.erosionAnchor, 1)
+			try:
+				subx, suby, subpx, subpy = self.FindCentre (roi)
+			except MarkerNotFound:
+				marker.Disable ()
+				continue
+			x = (left + subpx)/GRID_SIZE[0]
+			y = (top + subpy)/GRID_SIZE[1]
+
+			marker.Target (x, y, self.frameTime)
+
+			allRoi = self.colourMaskAll[top:bottom, left:right]
+			cv2.add (roi, allRoi, allRoi)
+			cv2.bitwise_and (self.gridFrame, self.gridFrame, self.extractedColours, mask)
+
+		cv2.mixChannels ([self.extractedColours,self.colourMaskAll],[self.gridMasked],
+				[0,2, 1,1, 2,0, 3,3])
+
+	def LocateBlobs (self, group):
+		''' Finds every marker in a group of (index, marker) pairs sharing a
+		colour range and leaves it to the tracker to match blobs to markers. '''
+		i, marker = group[0]
+		mask = self.colourMask[i]
+		cv2.erode (mask, self.fineErosion, self.erodedMask, self.erosionAnchor, 4)
+		blobs = FindBlobs (self.erodedMask, len(group), scratch=self.blobScratch)
+		self.tracker.AssignBlobs ([m for j, m in group],
+			[(px/GRID_SIZE[0], py/GRID_SIZE[1]) for px, py, area in blobs],
+			self.frameTime)
+		for j, m in group:
+			if not m.visible: continue
+			left = max (0, int(m.tX*GRID_SIZE[0] - ROI_SIZE/2))
+			top = max (0, int(m.tY*GRID_SIZE[1] - ROI_SIZE/2))
+			right = min (GRID_SIZE[0], left+ROI_SIZE)
+			bottom = min (GRID_SIZE[1], top+ROI_SIZE)
+			allRoi = self.colourMaskAll[top:bottom, left:right]
+			cv2.add (mask[top:bottom, left:right], allRoi, allRoi)
+		cv2.bitwise_and (self.gridFrame, self.gridFrame, self.extractedColours, mask)
+
+	def FindCentre (self, image):
+		moments = cv2.moments (image, True)
+		central = moments['m00']
+		if central == 0: raise MarkerNotFound ()
+		else:
+			px = moments['m10']/central
+			py = moments['m01']/central
+			x = px/GRID_SIZE[0]
+			y = py/GRID_SIZE[1]
+		return (x,y,px,py)
+
+	def OpenCapture (self, deviceID):
+		self.captureFrame = None
+		if IsVideoFile (deviceID) and os.path.isdir (deviceID):
+			self.capture = ImageSequence (deviceID)
+			return
+		self.capture = cv2.VideoCapture (deviceID)
+		if not IsVideoFile (deviceID): self.capture.read ()
+
+	def SetCaptureProperty (self, prop, value):
+		self.capture.set (prop, value)
+
+	def GetCaptureProperty (self, prop):
+		return self.capture.get (prop)
+
+	def NewStreamBuffer (self, dimensions):
+		w, h = dimensions
+		return np.zeros ((h,w,3), dtype=np.uint8)
+
+	def GetRawFrame (self):
+		''' Gets a reference to the current raw unprocessed frame data.
+
+		Not thread safe.'''
+		return cv.fromarray (self.origFrame)
+
+	def GetGridFrame (self):
+		''' Gets a reference to the current shrunk-for-processing data.
+
+		Not thread safe.'''
+		return self.gridFrameMat
+
+	def GetMaskedFrame (self):
+		''' Gets a reference to the current processed, feature-masked data.
+
+		Not thread safe.'''
+		return self.gridMaskedMat
+
+	# Array accessors for code that works with numpy directly.
+
+	def GetGridArray (self):
+		return self.gridFrame
+
+	def GetMaskedArray (self):
+		return self.gridMasked
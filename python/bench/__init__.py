@@ -0,0 +1,6 @@
+''' bench - Benchmarks for the detection -> tracker -> MIDI hot path.
+
+Run from the python directory with:
+
+	python -m bench.run [-o results.json]
+'''
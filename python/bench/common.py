@@ -0,0 +1,34 @@
+''' common.py - Timing helpers and stand-ins shared by the benchmarks.
+'''
+
+from profiling import Now
+from MIDIio import MIDIDevice
+from midibackend import LoopbackBackend
+
+def Measure (fn, repeat=200, warmup=10):
+	''' Calls fn repeatedly and returns timing statistics in milliseconds. '''
+	for i in range (warmup): fn ()
+	samples = []
+	for i in range (repeat):
+		start = Now ()
+		fn ()
+		samples.append ((Now () - start) * 1000.0)
+	return Summarise (samples)
+
+def Summarise (samples):
+	samples = sorted (samples)
+	n = len (samples)
+	return {
+		"n": n,
+		"min": samples[0],
+		"mean": sum (samples)/n,
+		"p50": samples[n/2],
+		"p99": samples[min (n-1, int(n*0.99))],
+		"max": samples[-1],
+	}
+
+def NullMIDIOut ():
+	''' An output whose messages go nowhere: a loopback with no inputs. '''
+	midiOut = MIDIDevice (mode=MIDIDevice.MODE_OUTPUT, backend=LoopbackBackend ())
+	midiOut.OpenPort (0)
+	return midiOut
@@ -0,0 +1,37 @@
+''' frames.py - Synthetic camera frames for benchmarking.
+'''
+
+import cv, cv2
+import numpy as np
+
+RESOLUTIONS = [(320,240), (640,480), (1280,720)]
+
+# BGR colours that fall inside the default marker colour ranges.
+DISC_COLOURS = [
+	(20,20,230), # Red
+	(40,200,40), # Green
+	(220,60,20), # Blue
+	(30,220,230), # Yellow
+]
+
+def SyntheticFrame (size, nDiscs=4, radius=None, seed=0, centres=None):
+	''' Returns a BGR uint8 frame of low-saturation noise with brightly
+	coloured discs on it, one per marker colour in turn. The discs are
+	placed at random unless a list of (x, y) centres is given. '''
+	w, h = size
+	random = np.random.RandomState (seed)
+	frame = random.randint (60, 120, (h,w,3)).astype (np.uint8)
+	if radius == None: radius = max (4, w/40)
+	if centres != None: nDiscs = len (centres)
+	for i in range (nDiscs):
+		if centres != None: centre = centres[i]
+		else: centre = (int(random.randint (radius, w-radius)), int(random.randint (radius, h-radius)))
+		cv2.circle (frame, centre, radius, DISC_COLOURS[i % len(DISC_COLOURS)], -1)
+	return frame
+
+def SyntheticImage (size, nDiscs=4, radius=None, seed=0):
+	''' SyntheticFrame as a legacy cv image. '''
+	frame = SyntheticFrame (size, nDiscs, radius, seed)
+	image = cv.CreateImage (size, 8, 3)
+	cv.Copy (cv.fromarray (frame), image)
+	return image
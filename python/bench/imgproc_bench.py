@@ -0,0 +1,95 @@
+''' imgproc_bench.py - Per-stage timings for StreamProcessor.
+
+Stages are timed individually at each synthetic resolution, with the
+processing frames the same size as the input so that the cost of every
+stage scales with it; resize is timed from the input size down to
+GRID_SIZE. The full ProcessFrame is timed as configured in config.py.
+
+threshold_all and classify_all both produce a mask for every tracker
+marker, per marker with cv.InRangeS and in one pass with HSVClassifier;
+compare them before turning on HSV_CLASSIFIER_LUT.
+
+frame_allocations is StreamProcessor.CountFrameAllocations with and
+without IMGPROC_PREALLOCATE. Neither is zero: ProcessFrame still makes
+Python objects such as marker groups and window rectangles every frame.
+'''
+
+import cv
+import numpy as np
+
+from config import *
+from imgproc import StreamProcessor, HSVClassifier
+from tracker import Tracker
+from bench.common import Measure
+from bench.frames import RESOLUTIONS, SyntheticImage
+
+def StageBenchmarks (size, repeat):
+	source = SyntheticImage (size)
+	orig = cv.CreateImage (size, 8, 3)
+	grid = cv.CreateImage (GRID_SIZE, 8, 3)
+	hsv = cv.CreateImage (size, 8, 3)
+	mask = cv.CreateImage (size, 8, 1)
+	eroded = cv.CreateImage (size, 8, 1)
+	extracted = cv.CreateImage (size, 8, 3)
+	masked = cv.CreateImage (size, 8, 4)
+	element = cv.CreateStructuringElementEx (2,2,0,0,cv.CV_SHAPE_RECT)
+	cv.Flip (source, orig, flipMode=-1)
+	cv.CvtColor (orig, hsv, cv.CV_BGR2HSV)
+	cv.InRangeS (hsv, (SN_BHUE[0],SN_BSAT[0],SN_BVAL[0]), (SN_BHUE[1],SN_BSAT[1],SN_BVAL[1]), mask)
+	cv.Erode (mask, eroded, element=element, iterations=4)
+
+	tracker = Tracker (None)
+	ranges = [marker.colourRange for marker in tracker.markers]
+	classifier = HSVClassifier (size, len(ranges))
+	classifier.Update (ranges)
+	hsvArray = np.asarray (cv.GetMat (hsv))
+	maskArrays = [np.zeros ((size[1],size[0]), dtype=np.uint8) for r in ranges]
+	masks = [cv.CreateImage (size, 8, 1) for r in ranges]
+	temp = cv.CreateImage (size, 8, 1)
+	proc = StreamProcessor (tracker, threadedCapture=False)
+
+	def ThresholdAll ():
+		for cRange, m in zip (ranges, masks):
+			proc.ThresholdColour (hsv, cRange, m, temp)
+
+	stages = [
+		("flip", lambda: cv.Flip (source, orig, flipMode=-1)),
+		("resize", lambda: cv.Resize (orig, grid)),
+		("cvtcolor", lambda: cv.CvtColor (orig, hsv, cv.CV_BGR2HSV)),
+		("inrange", lambda: cv.InRangeS (hsv,
+			(SN_BHUE[0],SN_BSAT[0],SN_BVAL[0]),
+			(SN_BHUE[1],SN_BSAT[1],SN_BVAL[1]), mask)),
+		("threshold_all", ThresholdAll),
+		("classify_all", lambda: classifier.Classify (hsvArray, maskArrays)),
+		("erode", lambda: cv.Erode (mask, eroded, element=element, iterations=4)),
+		("moments", lambda: cv.Moments (eroded)),
+		("mixchannels", lambda: cv.MixChannels ([extracted,mask],[masked],
+			[(0,2),(1,1),(2,0),(3,3)])),
+	]
+	return dict ((name, Measure (fn, repeat)) for name, fn in stages)
+
+def ProcessFrameBenchmark (size, repeat):
+	tracker = Tracker (None)
+	proc = StreamProcessor (tracker, threadedCapture=False)
+	proc.origFrame = SyntheticImage (size)
+	return Measure (proc.ProcessFrame, repeat)
+
+def AllocationBenchmark (size, repeat):
+	results = {}
+	for preallocate in (True, False):
+		proc = StreamProcessor (Tracker (None), threadedCapture=False, preallocate=preallocate)
+		proc.origFrame = SyntheticImage (size)
+		key = "preallocated" if preallocate else "unpreallocated"
+		results[key] = proc.CountFrameAllocations (nFrames=repeat)
+	return results
+
+def Run (repeat=200):
+	results = {"grid_size": list(GRID_SIZE)}
+	for size in RESOLUTIONS:
+		key = "%ix%i" % size
+		results[key] = {
+			"stages": StageBenchmarks (size, repeat),
+			"process_frame": ProcessFrameBenchmark (size, repeat),
+			"frame_allocations": AllocationBenchmark (size, repeat),
+		}
+	return results
@@ -0,0 +1,30 @@
+''' midi_bench.py - MIDIDevice send throughput against a loopback port with no listeners.
+'''
+
+from profiling import Now
+from bench.common import NullMIDIOut
+
+def Throughput (fn, nMessages):
+	''' Returns messages per second for nMessages calls of fn (i). '''
+	start = Now ()
+	for i in range (nMessages): fn (i)
+	elapsed = Now () - start
+	return nMessages/elapsed if elapsed > 0 else float('inf')
+
+def Run (nMessages=100000):
+	midiOut = NullMIDIOut ()
+	results = {
+		"note_on": Throughput (
+			lambda i: midiOut.NoteOn (i % 128, 100, channel=0x90), nMessages),
+		"note_off": Throughput (
+			lambda i: midiOut.NoteOff (i % 128, channel=0x90), nMessages),
+		"send_control": Throughput (
+			lambda i: midiOut.SendControl (i % 128, controller=2, channel=1), nMessages),
+		"set_control": Throughput (
+			lambda i: midiOut.SetControl ((i/8) % 128, controller=2, channel=1), nMessages),
+	}
+	def SendAndTick (i):
+		midiOut.SendNote (i % 128, 100, 0.0, channel=0x90)
+		midiOut.Tick ()
+	results["send_note_and_tick"] = Throughput (SendAndTick, nMessages/10)
+	return dict ((name, {"messages_per_second": rate}) for name, rate in results.items ())
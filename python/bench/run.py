@@ -0,0 +1,56 @@
+''' run.py - Runs the benchmarks and writes the results as JSON.
+
+Usage (from the python directory):
+
+	python -m bench.run [-o results.json] [--quick] [--only imgproc,tracker,midi]
+'''
+
+import json, platform, subprocess, sys, time
+from optparse import OptionParser
+
+SUITES = ["imgproc", "tracker", "midi"]
+
+def CurrentCommit ():
+	try:
+		return subprocess.check_output (["git", "rev-parse", "HEAD"]).strip ()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def RunSuites (names, quick=False):
+	results = {}
+	for name in names:
+		if name == "imgproc":
+			from bench import imgproc_bench
+			results[name] = imgproc_bench.Run (repeat=20 if quick else 200)
+		elif name == "tracker":
+			from bench import tracker_bench
+			results[name] = tracker_bench.Run (repeat=50 if quick else 500)
+		elif name == "midi":
+			from bench import midi_bench
+			results[name] = midi_bench.Run (nMessages=10000 if quick else 100000)
+	return results
+
+if __name__ == "__main__":
+	parser = OptionParser ()
+	parser.add_option ("-o", "--output", dest="output",
+		help="write results to this file instead of standard output")
+	parser.add_option ("-q", "--quick", action="store_true", default=False,
+		help="fewer repetitions, for a quick check")
+	parser.add_option ("--only", dest="only", default=",".join (SUITES),
+		help="comma-separated list of suites to run (%s)" % ", ".join (SUITES))
+	options, args = parser.parse_args ()
+	names = [name for name in options.only.split (",") if name]
+	for name in names:
+		if not name in SUITES: parser.error ("Unknown suite: %s" % name)
+	report = {
+		"commit": CurrentCommit (),
+		"time": time.strftime ("%Y-%m-%dT%H:%M:%S"),
+		"python": platform.python_version (),
+		"platform": platform.platform (),
+		"results": RunSuites (names, options.quick),
+	}
+	text = json.dumps (report, indent=2, sort_keys=True)
+	if options.output:
+		with open (options.output, "w") as f: f.write (text)
+	else:
+		print text
@@ -0,0 +1,55 @@
+''' tracker_bench.py - Timings for Tracker.Tick with many markers and strings.
+'''
+
+import math
+
+from config import *
+from tracker import Tracker, NoteMarker, CVMarker, MarkerStore
+from bench.common import Measure, NullMIDIOut
+
+MARKER_COUNTS = [4, 16, 64]
+STRING_COUNTS = [5, 48]
+
+def BuildTracker (nMarkers, nStrings, store=False):
+	midiOut = NullMIDIOut ()
+	tracker = Tracker (midiOut)
+	tracker.store = MarkerStore (midiOut) if store else None
+	base = tracker.markers[0]
+	tuning = range (nStrings)
+	tracker.markers = []
+	for i in range (nMarkers):
+		if i % 4 == 3:
+			marker = CVMarker (midiOut=midiOut, colourRange=base.colourRange)
+		else:
+			marker = NoteMarker (
+				midiOut=midiOut,
+				colourRange=base.colourRange,
+				scale=tracker.scale,
+				mode=i % 3,
+				tuning=tuning,
+				stringOffset=0.5)
+			# Spread the strings across the whole frame.
+			marker.SetStrings (marker.GenerateStrings (0.5, tuning, spacing=0.9/nStrings))
+		tracker.markers.append (marker)
+	return tracker
+
+def TrackerBenchmark (nMarkers, nStrings, repeat, store=False):
+	tracker = BuildTracker (nMarkers, nStrings, store)
+	state = {"frame": 0}
+	def Step ():
+		state["frame"] += 1
+		t = state["frame"] / 60.0
+		for i, marker in enumerate (tracker.markers):
+			# Sweep back and forth across the strings.
+			marker.Target (0.5 + 0.45*math.sin (t*2 + i), 0.5 + 0.3*math.cos (t + i))
+		tracker.Tick (1/60.0)
+	return Measure (Step, repeat)
+
+def Run (repeat=500):
+	results = {}
+	for nMarkers in MARKER_COUNTS:
+		for nStrings in STRING_COUNTS:
+			key = "%i_markers_%i_strings" % (nMarkers, nStrings)
+			results[key] = TrackerBenchmark (nMarkers, nStrings, repeat)
+			results[key + "_array_store"] = TrackerBenchmark (nMarkers, nStrings, repeat, store=True)
+	return results
@@ -14,8 +14,21 @@ WINDOW_TITLE = "ricercar"
 #
 ##
 
+MIDI_BACKEND = "rtmidi" # "rtmidi", "loopback" (in-memory, no MIDI system needed) or "record" (write output to MIDI_RECORD_FILE)
+MIDI_RECORD_FILE = "midi-out.txt"
+MIDI_SMF_FILE = "ricercar-%Y%m%d-%H%M%S.mid" # Record each performance to this MIDI file (strftime format); None to disable.
+MIDI_SMF_FLUSH_INTERVAL = 2.0 # Seconds between rewrites of the MIDI file while recording.
 MIDI_OUT_DEVICE = 0 # Use 0 for the built-in GS MIDI wavetable
 MIDI_IN_DEVICE = 0
+MIDI_INPUT_CALLBACK = True # Receive MIDI input as it arrives rather than polling once per frame.
+MIDI_INPUT_IMMEDIATE_TYPES = () # Types of incoming message, e.g.: 0xB0 for controllers, handled on the MIDI thread instead of at the next frame. Colour range changes still take effect at the next frame.
+MIDI_OUTPUT_SCHEDULER = True # Send timed messages, e.g.: note-offs, from a scheduler thread rather than once per frame.
+MIDI_SCHEDULER_RESOLUTION = 0.001 # The scheduler thread waits until this long before an event is due, then sleeps the rest of the way, in seconds.
+MIDI_SCHEDULER_MAX_WAIT = 0.003 # Longest single wait of the scheduler thread, bounding how late it notices an earlier event, in seconds.
+MIDI_OUTPUT_BATCHED = True # Collect each frame's MIDI output and send it in one go.
+MIDI_RUNNING_STATUS = False # Send batched output as one running-status stream. Only for outputs that take several messages per write; rtmidi doesn't on ALSA or Windows.
+NOTE_CROSSING_DELAY = None # If set, play notes this long after the moment, interpolated between frames, their string was crossed, in seconds. Evens out note timing at the cost of that much latency; None plays them as soon as the crossing is seen.
+MIDI_CC_MIN_INTERVAL = 0.02 # Shortest time between messages to the same controller from CV markers, in seconds.
 STREAM_DEVICE = 0
 STREAM_FPS = 60
 
@@ -33,20 +46,57 @@ STREAM_SIZES = [
 	(640,480)
 ]
 STREAM_RATES = [15,30,60]
+IMGPROC_BACKEND = "cv" # "cv" for the legacy IplImage API, "cv2" for preallocated numpy arrays.
+IMGPROC_PROCESS = False # Run capture and marker detection in a worker process.
+IMGPROC_WORKER_SLOTS = 3 # Size of the shared-memory frame ring used by the worker process.
+REPLAY_FPS = 30 # Frame rate assumed for image sequences, and for videos that don't report one.
+STREAM_THREADED_CAPTURE = True # Read frames on a separate thread so the main loop never waits on the driver.
 
 ROI_SIZE = 100 # Size of 'region of interest' used to narrow down marker location.
+IMGPROC_PREALLOCATE = True # Reuse image headers and ROIs between frames rather than making new OpenCV headers and clearing whole images each frame.
+TRACKING_ENABLED = True # Search for visible markers only around their predicted position.
+TRACKING_WINDOW_SIZE = 120 # Size of the search window used while tracking.
+TRACKING_REACQUIRE_INTERVAL = 30 # Frames between forced full-frame searches while tracking.
+MOTION_FILTER = None # Smooth marker tracks with a motion filter: None, "alphabeta" or "kalman".
+MOTION_FILTER_ALPHA = 0.7 # Alpha-beta filter: share of the position residual applied each frame.
+MOTION_FILTER_BETA = 0.3 # Alpha-beta filter: share of the residual applied to velocity.
+MOTION_FILTER_PROCESS_NOISE = 100.0 # Kalman filter: variance of marker acceleration, in (frame widths/s^2)^2.
+MOTION_FILTER_MEASUREMENT_NOISE = 4e-5 # Kalman filter: variance of detected positions, in frame widths^2.
+TRACKER_ARRAY_STORE = False # Keep marker state in NumPy arrays and tick all markers in a few vectorised steps. Only pays off with many markers: more than about 20 here.
+PYRAMID_LEVELS = 0 # Find markers in a frame downscaled by 2**PYRAMID_LEVELS first, then refine at full size. 0 disables.
+PYRAMID_EROSION_ITERATIONS = 1 # Erosion applied to the coarse mask.
+PYRAMID_WINDOW_SIZE = 120 # Size of the full-resolution window searched around a coarse candidate.
+BLOB_MIN_AREA = 4 # Smallest eroded blob, in grid pixels, accepted as a marker.
+HSV_CLASSIFIER_LUT = False # Classify all marker colours in one pass using lookup tables instead of per-marker thresholding; compare threshold_all and classify_all in bench/imgproc_bench first.
 
 
+##
+#
+# Profiling
+#
+##
+
+PROFILE_ENABLED = False # Time each stage of the main loop and show the results in the HUD.
+PROFILE_HISTORY = 300 # Number of recent timings kept per stage.
+PROFILE_TRACE_FILE = None # If set, e.g.: "ricercar-trace.json", every span is written here on exit.
+PROFILE_TRACE_LIMIT = 200000 # Most recent spans kept for the trace file.
+
 ##
 #
 # Music
 #
 ##
 
+# Number of markers tracked for each colour, in the order red, green, blue,
+# yellow. Markers of the same colour share settings and are told apart by
+# position.
+MARKER_INSTANCES = [1,1,1,1]
 MARKER_NOTE_DEFAULT_MODE = 0
 MARKER_NOTE_DEFAULT_DURATION = 0.4
 MARKER_CV_DEFAULT_X_CONTROLLER = 2
 MARKER_CV_DEFAULT_Y_CONTROLLER = 3
+MARKER_CV_DEFAULT_X_MODE = 0 # 0: 7-bit controller, 1: 14-bit controller pair, 2: pitch bend
+MARKER_CV_DEFAULT_Y_MODE = 0 # As above. A channel has one pitch bend, so a marker with both axes on one channel sends y as a 7-bit controller if x has it.
 MARKER_TRANSPOSE_OCTAVE_RANGE = [-2,-1,0,1,2]
 MARKER_TRANSPOSE_SEMITONE_RANGE = [i-12 for i in range(25)]
 MARKER_CONTROLLER_ID_RANGE = [i for i in range (24)] # TODO: probably should work out a better range...
@@ -100,6 +150,7 @@ UI_GLOBAL_CONFIG_COLUMN_WIDTH = 150
 UI_CV_CTRL_WIDTH = 100
 UI_SHOW_MENU_WIDTH = 200
 UI_EXIT_WIDTH = 50
+UI_PROFILE_WIDTH = 400
 
 CROSSHAIR_SIZE = 200
 CROSSHAIR_THICKNESS = 2.0
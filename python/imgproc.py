@@ -1,17 +1,260 @@
 import cv, cv2
+import numpy as np
+import os, threading, time
+from collections import deque
 from constants import *
+from profiling import AllocationCounter, profiler, Now
 
 from config import *
 
 class MarkerNotFound (Exception): pass
 
+def FindBlobs (mask, maxBlobs, minArea=BLOB_MIN_AREA, scratch=None):
+	''' Finds the connected regions of a binary uint8 mask and returns up to
+	maxBlobs of them as (px, py, area) tuples, largest first.
+
+	Uses cv2.connectedComponentsWithStats where OpenCV provides it (3.0+),
+	otherwise external contours. findContours modifies its input, so a
+	scratch array the same shape as mask may be supplied to avoid a copy.
+	'''
+	blobs = []
+	if hasattr (cv2, 'connectedComponentsWithStats'):
+		n, labels, stats, centroids = cv2.connectedComponentsWithStats (mask)
+		for label in range (1, n): # Label 0 is the background
+			area = stats[label, cv2.CC_STAT_AREA]
+			if area < minArea: continue
+			blobs.append ((centroids[label][0], centroids[label][1], area))
+	else:
+		if scratch is None: scratch = mask.copy ()
+		else: scratch[...] = mask
+		# The number of return values differs between OpenCV versions.
+		contours = cv2.findContours (scratch, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+		for contour in contours:
+			moments = cv2.moments (contour)
+			area = moments['m00']
+			if area < minArea or area == 0: continue
+			blobs.append ((moments['m10']/area, moments['m01']/area, area))
+	blobs.sort (key=lambda blob: blob[2], reverse=True)
+	return blobs[:maxBlobs]
+
+def IsVideoFile (source):
+	''' Video sources are camera device numbers, or paths to a video file or
+	a directory of still frames. '''
+	return isinstance (source, basestring)
+
+class ImageSequence:
+	''' Plays a directory of still images, in filename order, as if it were
+	a capture device. Supports both the legacy cv capture calls (through
+	StreamProcessor) and the cv2.VideoCapture read/get/set interface. '''
+	EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+	def __init__ (self, path, fps=REPLAY_FPS):
+		self.paths = sorted (os.path.join (path, name) for name in os.listdir (path)
+			if os.path.splitext (name)[1].lower () in ImageSequence.EXTENSIONS)
+		self.fps = fps
+		self.position = 0
+		self.width = self.height = 0
+		if self.paths:
+			first = cv.LoadImage (self.paths[0], cv.CV_LOAD_IMAGE_COLOR)
+			self.width, self.height = cv.GetSize (first)
+
+	def QueryFrame (self):
+		if self.position >= len(self.paths): return None
+		frame = cv.LoadImage (self.paths[self.position], cv.CV_LOAD_IMAGE_COLOR)
+		self.position += 1
+		return frame
+
+	def read (self, image=None):
+		if self.position >= len(self.paths): return (False, None)
+		frame = cv2.imread (self.paths[self.position], cv2.IMREAD_COLOR)
+		self.position += 1
+		return (frame is not None, frame)
+
+	def get (self, prop):
+		if prop == cv.CV_CAP_PROP_FRAME_WIDTH: return self.width
+		if prop == cv.CV_CAP_PROP_FRAME_HEIGHT: return self.height
+		if prop == cv.CV_CAP_PROP_FPS: return self.fps
+		if prop == cv.CV_CAP_PROP_FRAME_COUNT: return len(self.paths)
+		if prop == cv.CV_CAP_PROP_POS_FRAMES: return self.position
+		return 0
+
+	def set (self, prop, value):
+		if prop == cv.CV_CAP_PROP_POS_FRAMES:
+			self.position = int(value)
+			return True
+		return False
+
+class FrameGrabber:
+	''' Reads frames from a capture device on a dedicated thread.
+
+	Captured frames are flipped into one of a small pool of preallocated
+	buffers and published to a single-slot, latest-wins buffer. If the
+	consumer hasn't collected the previous frame by the time the next one
+	arrives, the stale frame is dropped rather than queued. The slot and the
+	free list are deques, whose append and pop operations are atomic, so no
+	locking is needed between the capture thread and the main loop.
+
+	readFrame (buf) fills a buffer and returns the time the frame was
+	captured, or None if no frame was available; newBuffer () allocates one.
+	'''
+	def __init__ (self, readFrame, newBuffer, nBuffers=3):
+		self.readFrame = readFrame
+		self.running = False
+		self.thread = None
+		self.latest = deque (maxlen=1)
+		self.free = deque ()
+		# One buffer for each of: the consumer, the slot, the capture thread.
+		for i in range (max (3, nBuffers)):
+			self.free.append (newBuffer ())
+		self.nDropped = 0
+
+	def Start (self):
+		self.running = True
+		self.thread = threading.Thread (target=self.CaptureLoop, name="FrameGrabber")
+		self.thread.daemon = True
+		self.thread.start ()
+
+	def Stop (self):
+		self.running = False
+		if self.thread != None:
+			self.thread.join ()
+			self.thread = None
+
+	def CaptureLoop (self):
+		while self.running:
+			buf = self.free.popleft ()
+			captureTime = self.readFrame (buf)
+			if captureTime == None:
+				self.free.append (buf)
+				time.sleep (0.001)
+				continue
+			# Recycle the uncollected frame, if any, then publish the new one.
+			try:
+				self.free.append (self.latest.pop ()[0])
+				self.nDropped += 1
+			except IndexError: pass
+			self.latest.append ((buf, captureTime))
+
+	def GetFrame (self):
+		''' Returns the most recently captured frame and its capture time, or
+		None if no new frame has arrived since the last call. The caller owns
+		the returned buffer until it is handed back with Release.'''
+		try:
+			return self.latest.pop ()
+		except IndexError:
+			return None
+
+	def Release (self, frame):
+		self.free.append (frame)
+
+class HSVClassifier:
+	''' Labels every pixel of an HSV image with the set of markers whose
+	colour range it falls in, in a single pass over the image.
+
+	Colour ranges are boxes in HSV space (red's second hue range only widens
+	the hue side), so the 3D HSV->label table factors into one 256-entry
+	bitmask table per channel: a pixel is in a range iff the range's bit is
+	set in the hue, saturation and value tables alike. Each distinct range
+	gets one bit, shared by all the markers that have it, in 8-bit labels of
+	up to eight ranges each. The tables are rebuilt only when a colour range
+	changes.
+
+	Labelling is one cv2.LUT over all three channels and two bitwise ANDs
+	per label, and each mask is then one more cv2.LUT from the label.
+	'''
+	def __init__ (self, size, nMarkers):
+		w, h = size
+		self.nMarkers = nMarkers
+		self.markerBits = [] # (label, bit) of each marker's colour range
+		self.tables = [] # Per label: a 256x1x3 table of range bits for each channel
+		self.labels = []
+		self.channels = np.zeros ((3,h,w), dtype=np.uint8)
+		self.labelled = np.zeros ((h,w,3), dtype=np.uint8)
+		# Tables from a label to the mask of each of its bits
+		levels = np.arange (256)
+		self.maskTables = [np.where (levels & (1 << bit), 255, 0).astype (np.uint8) for bit in range (8)]
+		self.signature = None
+
+	def Update (self, colourRanges):
+		''' Rebuilds the lookup tables if any colour range has changed. '''
+		signature = tuple (
+			(tuple(r.hue), tuple(r.saturation), tuple(r.value),
+				tuple(r.hue2) if r.hue2 != None else None)
+			for r in colourRanges)
+		if signature == self.signature: return
+		distinct = []
+		self.markerBits = []
+		for key in signature:
+			if not key in distinct: distinct.append (key)
+			self.markerBits.append (divmod (distinct.index (key), 8))
+		self.signature = signature
+		nLabels = (len(distinct) + 7) / 8
+		h, w = self.channels.shape[1:]
+		self.tables = [np.zeros ((256,1,3), dtype=np.uint8) for i in range (nLabels)]
+		while len(self.labels) < nLabels: self.labels.append (np.zeros ((h,w), dtype=np.uint8))
+		levels = np.arange (256)
+		for i, (hue, saturation, value, hue2) in enumerate (distinct):
+			table = self.tables[i / 8][:,0]
+			bit = 1 << (i % 8)
+			# Bounds follow cv.InRangeS: lower inclusive, upper exclusive.
+			inHue = (levels >= hue[0]) & (levels < hue[1])
+			if hue2 != None:
+				inHue |= (levels >= hue2[0]) & (levels < hue2[1])
+			table[inHue,0] |= bit
+			table[(levels >= saturation[0]) & (levels < saturation[1]),1] |= bit
+			table[(levels >= value[0]) & (levels < value[1]),2] |= bit
+
+	def Classify (self, hsv, masks, rect=None, indices=None):
+		''' Labels the pixels of hsv, an HxWx3 uint8 array, and writes a 0/255
+		mask for each marker into the corresponding array of masks.
+
+		If rect (left, top, width, height) is given only that region is
+		classified, and if indices is given only those markers' masks are
+		written. Markers may share a mask array, e.g.: clones of one colour,
+		in which case it's only written once. '''
+		labels = self.labels
+		channels = self.channels
+		labelled = self.labelled
+		if rect != None:
+			left, top, w, h = rect
+			rows = slice (top, top+h)
+			cols = slice (left, left+w)
+			hsv = hsv[rows,cols]
+			labels = [label[rows,cols] for label in labels]
+			channels = channels[:,rows,cols]
+			labelled = labelled[rows,cols]
+		if indices == None: indices = range (len(masks))
+		needed = set (self.markerBits[i][0] for i in indices)
+		for n in needed:
+			cv2.LUT (hsv, self.tables[n], labelled)
+			cv2.split (labelled, list (channels))
+			cv2.bitwise_and (channels[0], channels[1], labels[n])
+			cv2.bitwise_and (labels[n], channels[2], labels[n])
+		written = set ()
+		for i in indices:
+			mask = masks[i]
+			if id (mask) in written: continue
+			written.add (id (mask))
+			if rect != None: mask = mask[rows,cols]
+			n, bit = self.markerBits[i]
+			cv2.LUT (labels[n], self.maskTables[bit], mask)
+
 class StreamProcessor:
-	def __init__ (self, tracker):
+	def __init__ (self, tracker, threadedCapture=STREAM_THREADED_CAPTURE, preallocate=IMGPROC_PREALLOCATE):
 		self.tracker = tracker
+		self.threadedCapture = threadedCapture
+		self.preallocate = preallocate
 		
 		self.deviceID = None
 		self.modeChangeCallback = None
+		self.capture = None
+		self.grabber = None
+		self.endOfStream = False
+		self.clock = None
+		self.frameTime = None # When origFrame was captured, see profiling.Now
+		self.AllocateFrames ()
 
+	def AllocateFrames (self):
 		# Initialise frames used for image processing
 		self.gridFrame = cv.CreateImage (GRID_SIZE, 8, 3)
 		self.gridFrameHSV = cv.CreateImage (GRID_SIZE, 8, 3)
@@ -22,9 +265,13 @@ class StreamProcessor:
 		self.gridMask = cv.CreateImage (GRID_SIZE,8,1)
 		self.colourMaskTemp = cv.CreateImage (GRID_SIZE, 8, 1)
 		self.colourMaskAll = cv.CreateImage (GRID_SIZE, 8, 1)
+		# Markers sharing a colour range, i.e.: clones, share a mask.
 		self.colourMask = []
+		rangeMasks = {}
 		for i, marker in enumerate(self.tracker.markers):
-			self.colourMask.append (cv.CreateImage (GRID_SIZE, 8, 1))
+			key = id (marker.colourRange)
+			if not key in rangeMasks: rangeMasks[key] = cv.CreateImage (GRID_SIZE, 8, 1)
+			self.colourMask.append (rangeMasks[key])
 		self.extractedColours = cv.CreateImage (GRID_SIZE, 8, 3)
 		self.erodedMask = cv.CreateImage (GRID_SIZE, 8, 1)
 		self.markerRegion = cv.CreateImage ((ROI_SIZE,ROI_SIZE),8,1)
@@ -32,76 +279,359 @@ class StreamProcessor:
 		self.roughErosion = cv.CreateStructuringElementEx (3,3,0,0,cv.CV_SHAPE_RECT)
 		self.fineErosion = cv.CreateStructuringElementEx (2,2,0,0,cv.CV_SHAPE_RECT)
 
+		# Single-pass colour classification
+		self.classifier = None
+		if HSV_CLASSIFIER_LUT:
+			self.classifier = HSVClassifier (GRID_SIZE, len(self.tracker.markers))
+			self.gridFrameHSVArray = np.asarray (cv.GetMat (self.gridFrameHSV))
+			maskArrays = {}
+			for m in self.colourMask:
+				if not id (m) in maskArrays: maskArrays[id (m)] = np.asarray (cv.GetMat (m))
+			self.colourMaskArrays = [maskArrays[id (m)] for m in self.colourMask]
+
+		# Regions of colourMaskAll written to in the last frame, so that only
+		# those need clearing in preallocated mode.
+		self.maskRects = [None] * len(self.tracker.markers)
+
+		self.erodedMaskArray = np.asarray (cv.GetMat (self.erodedMask))
+
+		# Coarse frames for pyramid detection
+		self.coarseSize = None
+		self.coarseClassifier = None
+		if PYRAMID_LEVELS > 0:
+			self.coarseScale = 2**PYRAMID_LEVELS
+			size = self.coarseSize = (GRID_SIZE[0]/self.coarseScale, GRID_SIZE[1]/self.coarseScale)
+			self.coarseFrame = cv.CreateImage (size, 8, 3)
+			self.coarseFrameHSV = cv.CreateImage (size, 8, 3)
+			self.coarseMask = cv.CreateImage (size, 8, 1)
+			self.coarseMaskTemp = cv.CreateImage (size, 8, 1)
+			self.coarseEroded = cv.CreateImage (size, 8, 1)
+			if self.classifier != None:
+				self.coarseClassifier = HSVClassifier (size, len(self.tracker.markers))
+				self.coarseFrameHSVArray = np.asarray (cv.GetMat (self.coarseFrameHSV))
+				# Markers are classified one at a time into the same mask.
+				self.coarseMaskArrays = [np.asarray (cv.GetMat (self.coarseMask))] * len(self.tracker.markers)
+		self.blobScratch = np.zeros_like (self.erodedMaskArray)
+
+		# Predictive tracking state
+		self.fullFrame = (0, 0, GRID_SIZE[0], GRID_SIZE[1])
+		self.framesTracked = [0] * len(self.tracker.markers)
+		self.frameInterval = 0.0
+		self.lastFrameTime = None
+
 	def Tick (self):
-		if not self.capture: return
-		# Grab frame and prepare for processing
-		frame = cv.QueryFrame (self.capture)
-		cv.Flip (frame, self.origFrame,flipMode=-1)
-		cv.Resize (self.origFrame, self.gridFrame)
-		cv.CvtColor (self.gridFrame, self.gridFrameHSV, cv.CV_BGR2HSV)
-
-		cv.Set (self.colourMaskAll, (0,))
-		cv.Set (self.extractedColours, (0,0,0))
+		''' Processes the latest frame, if there is a new one. Returns True if
+		there was. '''
+		if not self.capture: return False
+		with profiler.Span ("imgproc.grab"):
+			if not self.GrabFrame (): return False # No new frame yet, nothing to do.
+		self.ProcessFrame ()
+		return True
+
+	def GrabFrame (self):
+		''' Makes the latest captured frame current as origFrame. Returns
+		False if there is no new frame. '''
+		if self.grabber != None:
+			grabbed = self.grabber.GetFrame ()
+			if grabbed == None: return False
+			self.grabber.Release (self.origFrame)
+			self.origFrame, self.frameTime = grabbed
+			return True
+		frameTime = self.ReadFrame (self.origFrame)
+		if frameTime == None: return False
+		self.frameTime = frameTime
+		return True
+
+	def ReadFrame (self, buf):
+		''' Reads a frame from the capture device into buf, flipping it.
+		Returns the time of capture, or None if there was no frame. '''
+		if isinstance (self.capture, ImageSequence):
+			captureTime = self.CaptureTime ()
+			frame = self.capture.QueryFrame ()
+		elif cv.GrabFrame (self.capture):
+			# Timestamp between grabbing and decoding, as close to the moment
+			# of capture as the driver lets us get.
+			captureTime = self.CaptureTime ()
+			frame = cv.RetrieveFrame (self.capture)
+		else:
+			frame = None
+		if frame == None:
+			if IsVideoFile (self.deviceID): self.endOfStream = True
+			return None
+		cv.Flip (frame, buf, flipMode=-1)
+		return captureTime
+
+	def CaptureTime (self):
+		if self.clock != None: return self.clock.now
+		return Now ()
+
+	def ProcessFrame (self):
+		''' Runs marker detection on origFrame. '''
+		if self.frameTime != None and self.lastFrameTime != None:
+			self.frameInterval = self.frameTime - self.lastFrameTime
+		self.lastFrameTime = self.frameTime
+
+		with profiler.Span ("imgproc.resize"):
+			cv.Resize (self.origFrame, self.gridFrame)
+		# HSV conversion happens on demand, for just the regions searched.
+		self.hsvConverted = False
+		self.coarsePrepared = False
+
+		if self.preallocate:
+			# Only the alpha channel needs to be clean, and only the marker
+			# regions were written to. Stale colour data under zero alpha is
+			# never visible.
+			for i, rect in enumerate (self.maskRects):
+				if rect == None: continue
+				cv.SetImageROI (self.colourMaskAll, rect)
+				cv.Set (self.colourMaskAll, (0,))
+				cv.ResetImageROI (self.colourMaskAll)
+				self.maskRects[i] = None
+		else:
+			cv.Set (self.colourMaskAll, (0,))
+			cv.Set (self.extractedColours, (0,0,0))
 		markers = self.tracker.markers
+		self.classified = False
+		if self.classifier != None:
+			self.classifier.Update ([marker.colourRange for marker in markers])
+			if self.coarseClassifier != None:
+				self.coarseClassifier.Update ([marker.colourRange for marker in markers])
+		for group in self.GroupMarkers ():
+			with profiler.Span ("imgproc.locate"):
+				self.LocateGroup (group)
+
+		with profiler.Span ("imgproc.mix"):
+			if self.preallocate:
+				# One copy for all markers; colourMaskAll covers every marker region.
+				cv.Copy (self.gridFrame, self.extractedColours, self.colourMaskAll)
+			cv.MixChannels ([self.extractedColours,self.colourMaskAll],[self.gridMasked],
+					[(0,2),(1,1),(2,0),(3,3)])
+		cv.WaitKey (1) # there's gotta be a better way...
+
+	def GroupMarkers (self):
+		''' Returns the tracker's markers as lists of (index, marker) pairs
+		sharing a colour range, which are detected together as blobs. Done
+		every frame, since the UI may swap a marker for one of another type. '''
+		groups = []
+		groupIndex = {}
 		for i, marker in enumerate (self.tracker.markers):
-			cRange = marker.colourRange
-			mask = self.colourMask[i]
-			# Extract colour map
-			cv.InRangeS (
-				self.gridFrameHSV,
-				(cRange.hue[0],cRange.saturation[0],cRange.value[0]),
-				(cRange.hue[1],cRange.saturation[1],cRange.value[1]),
-				mask)
-			if cRange.hue2 != None:
-				cv.InRangeS (
-					self.gridFrameHSV,
-					(cRange.hue2[0],cRange.saturation[0],cRange.value[0]),
-					(cRange.hue2[1],cRange.saturation[1],cRange.value[1]),
-					self.colourMaskTemp)
-				cv.Add (self.colourMaskTemp, mask, mask)
-			
-			# First pass: find approximate center to within ROI_SIZE pixels
-			cv.Erode (mask, self.erodedMask, element=self.fineErosion, iterations=4)
-			try:
-				x,y,px,py = self.FindCentre (self.erodedMask)
-			except MarkerNotFound:
+			key = id (marker.colourRange)
+			if not key in groupIndex:
+				groupIndex[key] = len (groups)
+				groups.append ([])
+			groups[groupIndex[key]].append ((i, marker))
+		return groups
+
+	def LocateGroup (self, group):
+		''' Finds a group of (index, marker) pairs that share a colour range. '''
+		if len (group) > 1:
+			self.LocateBlobs (group)
+			return
+		i, marker = group[0]
+		# Look near the predicted position first, if there is one.
+		window = self.SearchWindow (i, marker)
+		if window != None and self.LocateMarker (i, marker, window):
+			self.framesTracked[i] += 1
+			return
+		# (Re-)acquisition, either from a coarse candidate or the full frame
+		if self.coarseSize != None:
+			window = self.CoarseWindow (i, marker)
+			if window == None:
 				marker.Disable ()
-				continue
+				return
+		else:
+			window = self.fullFrame
+		if self.LocateMarker (i, marker, window):
+			self.framesTracked[i] = 0
+		else:
+			marker.Disable ()
 
-			# Second pass: discard outliers and recalculate centre
-			left = max (0, int(px - ROI_SIZE/2))
-			top = max (0, int(py - ROI_SIZE/2))
-			right = min (GRID_SIZE[0], left+ROI_SIZE)
-			bottom = min (GRID_SIZE[1], top+ROI_SIZE)
-			rect = (left,top,right-left,bottom-top)
+	def SearchWindow (self, i, marker):
+		''' Returns the region around the marker's predicted position to
+		search in, or None if the whole frame should be searched. '''
+		if not TRACKING_ENABLED or not marker.visible: return None
+		if self.framesTracked[i] >= TRACKING_REACQUIRE_INTERVAL: return None
+		px, py = marker.PredictPosition (self.frameInterval)
+		px *= GRID_SIZE[0]
+		py *= GRID_SIZE[1]
+		left = max (0, int(px - TRACKING_WINDOW_SIZE/2))
+		top = max (0, int(py - TRACKING_WINDOW_SIZE/2))
+		right = min (GRID_SIZE[0], left+TRACKING_WINDOW_SIZE)
+		bottom = min (GRID_SIZE[1], top+TRACKING_WINDOW_SIZE)
+		if right - left < ROI_SIZE/2 or bottom - top < ROI_SIZE/2: return None
+		return (left,top,right-left,bottom-top)
+
+	def ConvertHSV (self, window):
+		''' Makes sure gridFrameHSV is up to date within window. '''
+		if self.hsvConverted: return
+		with profiler.Span ("imgproc.hsv"):
+			if window == self.fullFrame:
+				cv.CvtColor (self.gridFrame, self.gridFrameHSV, cv.CV_BGR2HSV)
+				self.hsvConverted = True
+				return
+			cv.SetImageROI (self.gridFrame, window)
+			cv.SetImageROI (self.gridFrameHSV, window)
+			cv.CvtColor (self.gridFrame, self.gridFrameHSV, cv.CV_BGR2HSV)
+			cv.ResetImageROI (self.gridFrame)
+			cv.ResetImageROI (self.gridFrameHSV)
+
+	def ExtractColour (self, i, cRange, window):
+		''' Writes the colour map for marker i into its mask, within window. '''
+		self.ConvertHSV (window)
+		with profiler.Span ("imgproc.colour"):
+			self.ThresholdWindow (i, cRange, window)
+
+	def ThresholdWindow (self, i, cRange, window):
+		''' ExtractColour, once the HSV frame is ready. '''
+		mask = self.colourMask[i]
+		if self.classifier != None:
+			if window == self.fullFrame:
+				# Extract all colour maps at once, the first time one is needed.
+				if not self.classified:
+					self.classifier.Classify (self.gridFrameHSVArray, self.colourMaskArrays)
+					self.classified = True
+			else:
+				self.classifier.Classify (self.gridFrameHSVArray, self.colourMaskArrays,
+					rect=window, indices=(i,))
+			return
+		cv.SetImageROI (self.gridFrameHSV, window)
+		cv.SetImageROI (mask, window)
+		cv.SetImageROI (self.colourMaskTemp, window)
+		self.ThresholdColour (self.gridFrameHSV, cRange, mask, self.colourMaskTemp)
+		cv.ResetImageROI (self.colourMaskTemp)
+		cv.ResetImageROI (self.gridFrameHSV)
+		cv.ResetImageROI (mask)
+
+	def ThresholdColour (self, hsv, cRange, mask, temp):
+		''' Writes the pixels of hsv that fall in cRange to mask, using temp
+		for red's second hue range. '''
+		cv.InRangeS (
+			hsv,
+			(cRange.hue[0],cRange.saturation[0],cRange.value[0]),
+			(cRange.hue[1],cRange.saturation[1],cRange.value[1]),
+			mask)
+		if cRange.hue2 != None:
+			cv.InRangeS (
+				hsv,
+				(cRange.hue2[0],cRange.saturation[0],cRange.value[0]),
+				(cRange.hue2[1],cRange.saturation[1],cRange.value[1]),
+				temp)
+			cv.Add (temp, mask, mask)
+
+	def CoarseWindow (self, i, marker):
+		''' Looks for marker i in the downscaled frame and returns a
+		full-resolution window around it, or None if it isn't there. '''
+		if not self.coarsePrepared:
+			# Nearest-neighbour scaling keeps hues pure at colour boundaries.
+			cv.Resize (self.gridFrame, self.coarseFrame, cv.CV_INTER_NN)
+			cv.CvtColor (self.coarseFrame, self.coarseFrameHSV, cv.CV_BGR2HSV)
+			self.coarsePrepared = True
+		if self.coarseClassifier != None:
+			self.coarseClassifier.Classify (self.coarseFrameHSVArray,
+				self.coarseMaskArrays, indices=(i,))
+		else:
+			self.ThresholdColour (self.coarseFrameHSV, marker.colourRange,
+				self.coarseMask, self.coarseMaskTemp)
+		cv.Erode (self.coarseMask, self.coarseEroded, element=self.fineErosion,
+			iterations=PYRAMID_EROSION_ITERATIONS)
+		try:
+			x, y, px, py = self.FindCentre (self.coarseEroded)
+		except MarkerNotFound:
+			return None
+		px *= self.coarseScale
+		py *= self.coarseScale
+		left = max (0, int(px - PYRAMID_WINDOW_SIZE/2))
+		top = max (0, int(py - PYRAMID_WINDOW_SIZE/2))
+		right = min (GRID_SIZE[0], left+PYRAMID_WINDOW_SIZE)
+		bottom = min (GRID_SIZE[1], top+PYRAMID_WINDOW_SIZE)
+		return (left,top,right-left,bottom-top)
+
+	def LocateMarker (self, i, marker, window):
+		''' Searches for marker i within window (left, top, width, height) and
+		targets the marker at its centre. Returns False if it wasn't found. '''
+		mask = self.colourMask[i]
+		wLeft, wTop, wWidth, wHeight = window
+		self.ExtractColour (i, marker.colourRange, window)
+
+		# First pass: find approximate center to within ROI_SIZE pixels
+		cv.SetImageROI (mask, window)
+		cv.SetImageROI (self.erodedMask, window)
+		cv.Erode (mask, self.erodedMask, element=self.fineErosion, iterations=4)
+		cv.ResetImageROI (mask)
+		try:
+			x,y,px,py = self.FindCentre (self.erodedMask)
+		except MarkerNotFound:
+			return False
+		finally:
+			cv.ResetImageROI (self.erodedMask)
+		px += wLeft
+		py += wTop
+
+		# Second pass: discard outliers and recalculate centre
+		left = max (wLeft, int(px - ROI_SIZE/2))
+		top = max (wTop, int(py - ROI_SIZE/2))
+		right = min (wLeft+wWidth, left+ROI_SIZE)
+		bottom = min (wTop+wHeight, top+ROI_SIZE)
+		rect = (left,top,right-left,bottom-top)
+		if self.preallocate:
+			# Work on the image's own ROI rather than a new sub-matrix header.
+			cv.SetImageROI (mask, rect)
+			roi = mask
+		else:
 			roi = cv.GetSubRect (
 				cv.GetMat(mask),
 				rect)
-			cv.Erode (roi, roi, element=self.fineErosion, iterations=3)
-			cv.Dilate (roi, roi, element=self.fineErosion, iterations=1)
-			try:
-				subx, suby, subpx, subpy = self.FindCentre (roi)
-			except MarkerNotFound:
-				marker.Disable ()
-				continue
-			x = (left + subpx)/GRID_SIZE[0]
-			y = (top + subpy)/GRID_SIZE[1]
+		cv.Erode (roi, roi, element=self.fineErosion, iterations=3)
+		cv.Dilate (roi, roi, element=self.fineErosion, iterations=1)
+		try:
+			subx, suby, subpx, subpy = self.FindCentre (roi)
+		except MarkerNotFound:
+			return False
+		finally:
+			if self.preallocate: cv.ResetImageROI (mask)
+		x = (left + subpx)/GRID_SIZE[0]
+		y = (top + subpy)/GRID_SIZE[1]
 
-			marker.Target (x, y) 
+		marker.Target (x, y, self.frameTime)
+		self.ShowMarkerRegion (i, mask, rect)
+		return True
 
-			cv.SetImageROI (mask, rect)
-			cv.SetImageROI (self.colourMaskAll, rect)
-			cv.Add (mask, self.colourMaskAll, self.colourMaskAll)
-			cv.ResetImageROI (mask)
-			cv.ResetImageROI (self.colourMaskAll)
-			cv.Copy (self.gridFrame, self.extractedColours, mask)
-
-		cv.MixChannels ([self.extractedColours,self.colourMaskAll],[self.gridMasked],
-				[(0,2),(1,1),(2,0),(3,3)])
-		cv.WaitKey (1) # there's gotta be a better way...
+	def LocateBlobs (self, group):
+		''' Finds every marker in a group of (index, marker) pairs sharing a
+		colour range, using one colour pass and one erosion for all of them,
+		and leaves it to the tracker to match blobs to markers. '''
+		i, marker = group[0]
+		mask = self.colourMask[i]
+		self.ExtractColour (i, marker.colourRange, self.fullFrame)
+		cv.Erode (mask, self.erodedMask, element=self.fineErosion, iterations=4)
+		blobs = FindBlobs (self.erodedMaskArray, len(group), scratch=self.blobScratch)
+		markers = [m for j, m in group]
+		self.tracker.AssignBlobs (markers,
+			[(px/GRID_SIZE[0], py/GRID_SIZE[1]) for px, py, area in blobs],
+			self.frameTime)
+		for j, m in group:
+			if not m.visible: continue
+			left = max (0, int(m.tX*GRID_SIZE[0] - ROI_SIZE/2))
+			top = max (0, int(m.tY*GRID_SIZE[1] - ROI_SIZE/2))
+			right = min (GRID_SIZE[0], left+ROI_SIZE)
+			bottom = min (GRID_SIZE[1], top+ROI_SIZE)
+			self.ShowMarkerRegion (j, mask, (left,top,right-left,bottom-top))
+
+	def ShowMarkerRegion (self, i, mask, rect):
+		''' Adds the region of mask around marker i to the masked frame. '''
+		cv.SetImageROI (mask, rect)
+		cv.SetImageROI (self.colourMaskAll, rect)
+		cv.Add (mask, self.colourMaskAll, self.colourMaskAll)
+		cv.ResetImageROI (mask)
+		cv.ResetImageROI (self.colourMaskAll)
+		if self.preallocate: self.maskRects[i] = rect
+		else: cv.Copy (self.gridFrame, self.extractedColours, mask)
 
 	def FindCentre (self, image):
-		moments = cv.Moments (cv.GetMat(image))
+		# cv.Moments accepts images directly and honours their ROI, so the
+		# extra matrix header is only made outside preallocated mode.
+		if not self.preallocate: image = cv.GetMat (image)
+		moments = cv.Moments (image)
 		central = cv.GetCentralMoment (moments, 0, 0)
 		if central == 0: raise MarkerNotFound ()
 		else:
@@ -111,43 +641,101 @@ class StreamProcessor:
 			y = py/GRID_SIZE[1]
 		return (x,y,px,py)
 
+	def CountFrameAllocations (self, nWarmup=10, nFrames=100):
+		''' Runs ProcessFrame repeatedly on the current frame and returns the
+		average peak memory allocated per frame once warmed up, in bytes,
+		whether or not it is freed again by the end of the frame. On Python 2
+		it's the net number of objects left behind instead; see
+		AllocationCounter.
+
+		Preallocation only does away with the OpenCV headers and images, so
+		this is not zero: compare it with and without preallocate. '''
+		for i in range (nWarmup): self.ProcessFrame ()
+		counter = AllocationCounter ()
+		counter.Start ()
+		total = 0
+		for i in range (nFrames):
+			counter.Begin ()
+			self.ProcessFrame ()
+			total += counter.End ()
+		counter.Stop ()
+		return float(total)/nFrames
+
 	def SetVideoSource (self, deviceID=STREAM_DEVICE, rWidth=STREAM_SIZE[0], rHeight=STREAM_SIZE[1], rFPS=STREAM_FPS):
 		''' Opens a video stream, optionally requesting one or more parameters from
-		the driver.'''
+		the driver.
+
+		deviceID may also be the path of a video file or of a directory of
+		still frames, in which case the requested parameters are ignored.'''
 		self.deviceID = deviceID
+		self.StopCapture ()
+		self.endOfStream = False
 		# Open the stream.
-		self.capture = cv.CaptureFromCAM (deviceID)
-		cv.QueryFrame (self.capture)
-		# Attempt to set parameters.
-		cv.SetCaptureProperty (self.capture, cv.CV_CAP_PROP_FRAME_WIDTH,rWidth)
-		cv.SetCaptureProperty (self.capture, cv.CV_CAP_PROP_FRAME_WIDTH,rWidth)
-		cv.SetCaptureProperty (self.capture, cv.CV_CAP_PROP_FRAME_HEIGHT,rHeight)
-		cv.SetCaptureProperty (self.capture, cv.CV_CAP_PROP_FRAME_HEIGHT,rHeight)
-		#if not fps == None:
-		cv.SetCaptureProperty (self.capture, cv.CV_CAP_PROP_FPS,rFPS)
-		cv.WaitKey (10)
+		self.OpenCapture (deviceID)
+		if not IsVideoFile (deviceID):
+			# Attempt to set parameters.
+			self.SetCaptureProperty (cv.CV_CAP_PROP_FRAME_WIDTH,rWidth)
+			self.SetCaptureProperty (cv.CV_CAP_PROP_FRAME_WIDTH,rWidth)
+			self.SetCaptureProperty (cv.CV_CAP_PROP_FRAME_HEIGHT,rHeight)
+			self.SetCaptureProperty (cv.CV_CAP_PROP_FRAME_HEIGHT,rHeight)
+			#if not fps == None:
+			self.SetCaptureProperty (cv.CV_CAP_PROP_FPS,rFPS)
+			cv.WaitKey (10)
 		# Now get the actual parameters used:
-		aWidth = self.streamWidth = int(cv.GetCaptureProperty (self.capture, cv.CV_CAP_PROP_FRAME_WIDTH))
-		aHeight = self.streamHeight = int(cv.GetCaptureProperty (self.capture, cv.CV_CAP_PROP_FRAME_HEIGHT))
+		aWidth = self.streamWidth = int(self.GetCaptureProperty (cv.CV_CAP_PROP_FRAME_WIDTH))
+		aHeight = self.streamHeight = int(self.GetCaptureProperty (cv.CV_CAP_PROP_FRAME_HEIGHT))
 		
-		if not (rWidth == aWidth and rHeight == aHeight):
+		if not IsVideoFile (deviceID) and not (rWidth == aWidth and rHeight == aHeight):
 			print "Failed to set resolution at %ix%i, instead got %ix%i" % (
 					rWidth,rHeight,aWidth,aHeight)
-		self.streamFPS = int(cv.GetCaptureProperty (self.capture, cv.CV_CAP_PROP_FPS))
+		self.streamFPS = int(self.GetCaptureProperty (cv.CV_CAP_PROP_FPS))
+		if IsVideoFile (deviceID) and self.streamFPS <= 0:
+			self.streamFPS = REPLAY_FPS
 		if aWidth == 0 or aHeight == 0:
 			self.capture = None
-			self.modeChangeCallback ()
+			if self.modeChangeCallback: self.modeChangeCallback ()
 			return
 		
 		dimensions = (aWidth, aHeight)
-		if not dimensions in STREAM_SIZES:
+		if not IsVideoFile (deviceID) and not dimensions in STREAM_SIZES:
 			STREAM_SIZES.append (dimensions)
 			print "Detected unsupported resolution %ix%i" % (aWidth,aHeight)
 
 		# Initialise frame buffer
-		self.origFrame = cv.CreateImage (dimensions, 8, 3)
+		self.origFrame = self.NewStreamBuffer (dimensions)
+		if self.threadedCapture:
+			self.grabber = FrameGrabber (
+				self.ReadFrame,
+				lambda: self.NewStreamBuffer (dimensions))
+			self.grabber.Start ()
 		
-		self.modeChangeCallback ()
+		if self.modeChangeCallback: self.modeChangeCallback ()
+
+	def OpenCapture (self, deviceID):
+		if not IsVideoFile (deviceID):
+			self.capture = cv.CaptureFromCAM (deviceID)
+			cv.QueryFrame (self.capture)
+		elif os.path.isdir (deviceID):
+			self.capture = ImageSequence (deviceID)
+		else:
+			self.capture = cv.CaptureFromFile (deviceID)
+
+	def SetCaptureProperty (self, prop, value):
+		if isinstance (self.capture, ImageSequence): self.capture.set (prop, value)
+		else: cv.SetCaptureProperty (self.capture, prop, value)
+
+	def GetCaptureProperty (self, prop):
+		if isinstance (self.capture, ImageSequence): return self.capture.get (prop)
+		return cv.GetCaptureProperty (self.capture, prop)
+
+	def NewStreamBuffer (self, dimensions):
+		return cv.CreateImage (dimensions, 8, 3)
+
+	def StopCapture (self):
+		''' Stops the capture thread, if there is one. '''
+		if self.grabber != None:
+			self.grabber.Stop ()
+			self.grabber = None
 
 	def NextVideoSource (self):
 		if self.deviceID == None: self.deviceID = 0
@@ -178,5 +766,10 @@ class StreamProcessor:
 		Not thread safe.'''
 		return self.gridMasked
 
+	def SetClock (self, clock):
+		''' Takes capture times from clock.now instead of the system time,
+		e.g.: when replaying a recording faster than real time. '''
+		self.clock = clock
+
 	def SetModeChangeCallback (self, callback):
 		self.modeChangeCallback = callback
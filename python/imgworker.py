@@ -0,0 +1,258 @@
+''' imgworker.py - Runs capture and marker detection in a separate process.
+
+The worker process owns the video device and a StreamProcessor of its own.
+Processed frames are handed back through a ring of shared-memory slots and
+marker positions through a queue of fixed-layout records, so detection and
+OpenGL rendering can run on separate cores without contending for the GIL.
+'''
+
+import cv, time, struct
+import numpy as np
+import multiprocessing as mp
+from Queue import Empty
+
+from imgproc import StreamProcessor
+from profiling import Now
+from arrayproc import ArrayStreamProcessor
+from tracker import HSVColourRange, MatchBlobs
+from constants import *
+from config import *
+
+# Record layouts for the result queue. Each record is a header followed by
+# one marker record per tracked marker, in tracker order.
+RESULT_HEADER = struct.Struct ('<IId') # Frame sequence number, ring slot, age of the frame in seconds (-1 if unknown)
+RESULT_MARKER = struct.Struct ('<Bdd') # Found flag, x, y
+
+# Control messages, main process -> worker
+CTRL_SOURCE = 0
+CTRL_RANGES = 1
+CTRL_STOP = 2
+
+def RangeKey (r):
+	return tuple (tuple(v) if v != None else None for v in r)
+
+def ColourRangeFromTuple (r):
+	hue, saturation, value, hue2 = r
+	return HSVColourRange (hue, saturation, value, hue2)
+
+class WorkerMarker:
+	''' Stands in for a tracker marker inside the worker process, recording
+	the result of detection rather than acting on it. '''
+	def __init__ (self, colourRange):
+		self.colourRange = colourRange
+		self.visible = False
+		self.tX = 0.0
+		self.tY = 0.0
+		self.vx = self.vy = 0.0
+
+	def Target (self, x, y, t=None):
+		self.visible = True
+		self.tX = x
+		self.tY = y
+
+	def Disable (self):
+		self.visible = False
+
+	def PredictPosition (self, dt):
+		return (self.tX, self.tY)
+
+class WorkerTracker:
+	''' Holds the worker's markers. Markers with identical colour ranges
+	share one HSVColourRange, as they do in the main process, so that the
+	stream processor detects them together. '''
+	def __init__ (self, ranges):
+		shared = {}
+		self.markers = []
+		for r in ranges:
+			key = RangeKey (r)
+			if not key in shared: shared[key] = ColourRangeFromTuple (r)
+			self.markers.append (WorkerMarker (shared[key]))
+
+	def SetRanges (self, ranges):
+		for marker, (hue, saturation, value, hue2) in zip (self.markers, ranges):
+			colourRange = marker.colourRange
+			colourRange.hue[:] = hue
+			colourRange.saturation[:] = saturation
+			colourRange.value[:] = value
+			colourRange.hue2 = hue2
+
+	def AssignBlobs (self, markers, blobs, frameTime=None):
+		MatchBlobs (markers, blobs, frameTime)
+
+def FrameViews (shared, nSlots, channels):
+	''' Returns one numpy view per ring slot onto a shared byte array. '''
+	w, h = GRID_SIZE
+	ring = np.frombuffer (shared, dtype=np.uint8).reshape ((nSlots, h, w, channels))
+	return [ring[i] for i in range (nSlots)]
+
+def WorkerMain (ranges, gridShared, maskShared, nSlots, readSlot, control, results, status):
+	''' Entry point of the worker process. '''
+	tracker = WorkerTracker (ranges)
+	if IMGPROC_BACKEND == "cv2":
+		proc = ArrayStreamProcessor (tracker, threadedCapture=False)
+	else:
+		proc = StreamProcessor (tracker, threadedCapture=False)
+	def ModeChanged ():
+		status.put ((proc.deviceID, proc.capture != None,
+			getattr (proc, 'streamWidth', 0),
+			getattr (proc, 'streamHeight', 0),
+			getattr (proc, 'streamFPS', 0)))
+	proc.SetModeChangeCallback (ModeChanged)
+	gridViews = FrameViews (gridShared, nSlots, 3)
+	maskViews = FrameViews (maskShared, nSlots, 4)
+	record = bytearray (RESULT_HEADER.size + RESULT_MARKER.size*len(tracker.markers))
+	seq = 0
+	slot = 0
+	while True:
+		try:
+			while True:
+				msg = control.get_nowait ()
+				if msg[0] == CTRL_STOP: return
+				elif msg[0] == CTRL_SOURCE: proc.SetVideoSource (*msg[1:])
+				elif msg[0] == CTRL_RANGES: tracker.SetRanges (msg[1])
+		except Empty: pass
+		if not proc.capture or proc.endOfStream:
+			time.sleep (0.01)
+			continue
+		# Only publish frames that were actually processed, so that a source
+		# with nothing new, e.g.: a file at its end, doesn't repeat the last one.
+		if not proc.Tick (): continue
+
+		# Pick the next slot, skipping the one the main process is displaying.
+		slot = (slot + 1) % nSlots
+		if slot == readSlot.value: slot = (slot + 1) % nSlots
+		gridViews[slot][...] = np.asarray (cv.GetMat (proc.GetGridFrame ()))
+		maskViews[slot][...] = np.asarray (cv.GetMat (proc.GetMaskedFrame ()))
+
+		seq += 1
+		# The worker's clock may not share an epoch with the main process's,
+		# e.g.: time.clock on Windows, so send how old the frame is instead.
+		age = Now () - proc.frameTime if proc.frameTime != None else -1.0
+		RESULT_HEADER.pack_into (record, 0, seq, slot, age)
+		offset = RESULT_HEADER.size
+		for marker in tracker.markers:
+			RESULT_MARKER.pack_into (record, offset, marker.visible, marker.tX, marker.tY)
+			offset += RESULT_MARKER.size
+		results.put (bytes (record))
+
+class ProcessStreamProcessor:
+	''' Presents the StreamProcessor interface to the rest of ricercar while
+	doing the actual capture and detection in a worker process.
+
+	Frames live in a shared-memory ring rather than copied, so a
+	rendered frame may occasionally tear if the worker laps the main loop.
+	Marker positions are unaffected since they travel on the result queue.
+	'''
+	def __init__ (self, tracker, nSlots=IMGPROC_WORKER_SLOTS):
+		self.tracker = tracker
+		self.nSlots = max (3, nSlots)
+		self.deviceID = None
+		self.modeChangeCallback = None
+		self.capture = None
+		self.streamWidth = self.streamHeight = self.streamFPS = 0
+		self.seq = 0
+		self.frameTime = None
+
+		w, h = GRID_SIZE
+		self.gridShared = mp.RawArray ('B', self.nSlots*w*h*3)
+		self.maskShared = mp.RawArray ('B', self.nSlots*w*h*4)
+		self.readSlot = mp.RawValue ('i', -1)
+		self.gridViews = [cv.fromarray (v) for v in FrameViews (self.gridShared, self.nSlots, 3)]
+		self.maskViews = [cv.fromarray (v) for v in FrameViews (self.maskShared, self.nSlots, 4)]
+		self.gridFrame = self.gridViews[0]
+		self.gridMasked = self.maskViews[0]
+
+		self.control = mp.Queue ()
+		self.results = mp.Queue ()
+		self.status = mp.Queue ()
+		self.ranges = self.GetRanges ()
+		self.worker = mp.Process (
+			target = WorkerMain,
+			name = "ImgProc",
+			args = (self.ranges,
+				self.gridShared, self.maskShared, self.nSlots, self.readSlot, self.control, self.results, self.status))
+		self.worker.daemon = True
+		self.worker.start ()
+
+	def GetRanges (self):
+		return [(m.colourRange.hue[:], m.colourRange.saturation[:],
+			m.colourRange.value[:],
+			m.colourRange.hue2[:] if m.colourRange.hue2 != None else None)
+			for m in self.tracker.markers]
+
+	def Tick (self):
+		# Forward colour sensitivity changes, e.g.: from MIDI knobs.
+		ranges = self.GetRanges ()
+		if ranges != self.ranges:
+			self.ranges = ranges
+			self.control.put ((CTRL_RANGES, ranges))
+
+		# Video mode changes reported by the worker
+		try:
+			while True:
+				self.ModeChanged (*self.status.get_nowait ())
+		except Empty: pass
+
+		# Only the most recent result is of interest.
+		record = None
+		try:
+			while True: record = self.results.get_nowait ()
+		except Empty: pass
+		if record == None: return
+		self.seq, slot, age = RESULT_HEADER.unpack_from (record, 0)
+		# Rebase the frame's age onto this process's clock. Time spent in
+		# the queue isn't included, so frames look that much newer.
+		self.frameTime = Now () - age if age >= 0 else None
+		self.readSlot.value = slot
+		self.gridFrame = self.gridViews[slot]
+		self.gridMasked = self.maskViews[slot]
+		offset = RESULT_HEADER.size
+		for marker in self.tracker.markers:
+			found, x, y = RESULT_MARKER.unpack_from (record, offset)
+			offset += RESULT_MARKER.size
+			if found: marker.Target (x, y, self.frameTime)
+			else: marker.Disable ()
+
+	def ModeChanged (self, deviceID, ok, width, height, fps):
+		self.deviceID = deviceID
+		self.capture = True if ok else None
+		self.streamWidth = width
+		self.streamHeight = height
+		self.streamFPS = fps
+		if self.modeChangeCallback: self.modeChangeCallback ()
+
+	def SetVideoSource (self, deviceID=STREAM_DEVICE, rWidth=STREAM_SIZE[0], rHeight=STREAM_SIZE[1], rFPS=STREAM_FPS):
+		''' Asks the worker to open a video stream. The mode change callback
+		fires once the worker has reported back. '''
+		self.deviceID = deviceID
+		self.control.put ((CTRL_SOURCE, deviceID, rWidth, rHeight, rFPS))
+
+	def NextVideoSource (self):
+		if self.deviceID == None: self.deviceID = 0
+		else: self.deviceID += 1
+		self.SetVideoSource (deviceID = self.deviceID)
+
+	def PreviousVideoSource (self):
+		if self.deviceID == None: self.deviceID = 0
+		elif self.deviceID > 0: self.deviceID -= 1
+		else: return
+		self.SetVideoSource (deviceID = self.deviceID)
+
+	def StopCapture (self):
+		if self.worker.is_alive ():
+			self.control.put ((CTRL_STOP,))
+			self.worker.join (1.0)
+
+	def GetRawFrame (self):
+		''' The raw frame stays in the worker; the grid frame is the closest
+		thing available. '''
+		return self.gridFrame
+
+	def GetGridFrame (self):
+		return self.gridFrame
+
+	def GetMaskedFrame (self):
+		return self.gridMasked
+
+	def SetModeChangeCallback (self, callback):
+		self.modeChangeCallback = callback
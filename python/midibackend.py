@@ -0,0 +1,159 @@
+''' midibackend.py - Where MIDIDevice's messages actually go.
+
+A backend lists the available input and output ports and creates port
+objects for MIDIDevice to open. Port objects follow the python-rtmidi API
+(open_port, close_port, send_message, get_message, set_callback) so that
+rtmidi's own MidiIn and MidiOut can be used as they are.
+
+RtMidiBackend: hardware and virtual ports through rtmidi.
+LoopbackBackend: one in-memory port; whatever is sent to its output arrives
+	at its inputs. Needs no MIDI system, for headless runs and tests.
+RecordingBackend: an output port that writes each message to a text file
+	with a timestamp from profiling.Now, for measuring end-to-end latency.
+'''
+
+from collections import deque
+
+from profiling import Now
+import config
+
+class RtMidiBackend:
+	''' rtmidi is imported, and its ports enumerated, on first use rather
+	than at import time. '''
+	def __init__ (self):
+		self.inPorts = None
+		self.outPorts = None
+
+	def InputPorts (self):
+		if self.inPorts == None:
+			import rtmidi
+			self.inPorts = [str(portName) for portName in rtmidi.MidiIn().get_ports ()]
+		return self.inPorts
+
+	def OutputPorts (self):
+		if self.outPorts == None:
+			import rtmidi
+			self.outPorts = [str(portName) for portName in rtmidi.MidiOut().get_ports ()]
+		return self.outPorts
+
+	def NewInput (self):
+		import rtmidi
+		return rtmidi.MidiIn ()
+
+	def NewOutput (self):
+		import rtmidi
+		return rtmidi.MidiOut ()
+
+class LoopbackInput:
+	def __init__ (self, backend):
+		self.backend = backend
+		self.callback = None
+		self.data = None
+		self.messages = deque ()
+		self.lastTime = None
+
+	def open_port (self, port=0):
+		self.backend.inputs.append (self)
+
+	def close_port (self):
+		if self in self.backend.inputs: self.backend.inputs.remove (self)
+
+	def set_callback (self, callback, data=None):
+		self.callback = callback
+		self.data = data
+
+	def cancel_callback (self):
+		self.callback = None
+
+	def get_message (self):
+		try:
+			return self.messages.popleft ()
+		except IndexError:
+			return None
+
+	def Receive (self, message):
+		now = Now ()
+		delta = now - self.lastTime if self.lastTime != None else 0.0
+		self.lastTime = now
+		event = (list (message), delta)
+		if self.callback != None: self.callback (event, self.data)
+		else: self.messages.append (event)
+
+class LoopbackOutput:
+	def __init__ (self, backend):
+		self.backend = backend
+		self.nMessages = 0
+
+	def open_port (self, port=0): pass
+
+	def close_port (self): pass
+
+	def send_message (self, message):
+		self.nMessages += 1
+		for port in self.backend.inputs: port.Receive (message)
+
+class LoopbackBackend:
+	def __init__ (self):
+		self.inputs = []
+
+	def InputPorts (self):
+		return ["Loopback"]
+
+	def OutputPorts (self):
+		return ["Loopback"]
+
+	def NewInput (self):
+		return LoopbackInput (self)
+
+	def NewOutput (self):
+		return LoopbackOutput (self)
+
+class RecordingOutput:
+	''' Writes one line per message: the time sent, in seconds, followed by
+	the message bytes in hex. '''
+	def __init__ (self, path):
+		self.path = path
+		self.file = None
+
+	def open_port (self, port=0):
+		self.file = open (self.path, "w")
+
+	def close_port (self):
+		if self.file != None: self.file.close ()
+		self.file = None
+
+	def send_message (self, message):
+		if self.file == None: return
+		self.file.write ("%.6f %s\n" % (Now (), " ".join ("%02x" % int(b) for b in message)))
+
+class RecordingBackend:
+	def __init__ (self, path=config.MIDI_RECORD_FILE):
+		self.path = path
+
+	def InputPorts (self):
+		return []
+
+	def OutputPorts (self):
+		return [self.path]
+
+	def NewInput (self):
+		# Nothing to record from; an input that never receives anything.
+		return LoopbackInput (LoopbackBackend ())
+
+	def NewOutput (self):
+		return RecordingOutput (self.path)
+
+BACKENDS = {
+	"rtmidi": RtMidiBackend,
+	"loopback": LoopbackBackend,
+	"record": RecordingBackend,
+}
+
+defaultBackend = None
+
+def GetBackend ():
+	''' The backend named by MIDI_BACKEND, shared by every MIDIDevice that
+	isn't given one of its own. '''
+	global defaultBackend
+	if defaultBackend == None: defaultBackend = BACKENDS[config.MIDI_BACKEND] ()
+	return defaultBackend
@@ -0,0 +1,109 @@
+''' midisched.py - Sends MIDI messages at given times from a thread of its own.
+
+Without it, a note-off is only sent the next time the main loop gets round to
+ticking MIDI output, so note lengths are rounded up to whole video frames.
+The scheduler keeps pending messages in a heap ordered by due time and sleeps
+until the earliest of them is due, independent of rendering and detection.
+'''
+
+import heapq, threading, time
+
+from profiling import Now
+import config
+
+class MIDIScheduler:
+	''' A heap of (time, sequence, message, key) events serviced by a daemon
+	thread. send is called with each message as it falls due.
+
+	Events may carry a key, e.g.: (status, note) for note-offs. Scheduling an
+	event replaces any pending event with the same key, and Cancel (key) drops
+	it. Replaced events stay in the heap and are skipped when they come up.
+	'''
+	def __init__ (self, send, resolution=config.MIDI_SCHEDULER_RESOLUTION,
+			maxWait=config.MIDI_SCHEDULER_MAX_WAIT):
+		self.send = send
+		self.resolution = resolution
+		self.maxWait = maxWait
+		self.events = []
+		self.pending = {} # key -> event
+		self.seq = 0
+		self.lock = threading.Condition (threading.Lock ())
+		self.running = False
+		self.thread = None
+
+	def Start (self):
+		if self.running: return
+		self.running = True
+		self.thread = threading.Thread (target=self.Run, name="MIDIScheduler")
+		self.thread.daemon = True
+		self.thread.start ()
+
+	def Stop (self):
+		with self.lock:
+			self.running = False
+			self.lock.notify ()
+		if self.thread != None: self.thread.join (1.0)
+		self.thread = None
+
+	def Schedule (self, when, message, key=None):
+		''' Sends message at time when, as given by profiling.Now. '''
+		with self.lock:
+			event = [when, self.seq, message, key]
+			self.seq += 1
+			if key != None:
+				previous = self.pending.get (key)
+				if previous != None: previous[2] = None
+				self.pending[key] = event
+			heapq.heappush (self.events, event)
+			if self.events[0] is event: self.lock.notify ()
+
+	def Cancel (self, key):
+		''' Drops the pending event with the given key, if any. Returns True
+		if there was one. '''
+		with self.lock:
+			event = self.pending.pop (key, None)
+			if event == None: return False
+			event[2] = None
+			return True
+
+	def Flush (self, keep=None):
+		''' Sends all pending events now, in time order, and empties the
+		queue. If keep is given, only events for which keep (message) is true
+		are sent. '''
+		with self.lock:
+			events = sorted (self.events)
+			self.events = []
+			self.pending = {}
+		for when, seq, message, key in events:
+			if message == None: continue
+			if keep == None or keep (message): self.send (message)
+
+	def Run (self):
+		while True:
+			with self.lock:
+				if not self.running: return
+				if len(self.events) == 0:
+					self.lock.wait ()
+					continue
+				remaining = self.events[0][0] - Now ()
+				if remaining > self.resolution:
+					# Wait for most of the time, a slice at a time. On
+					# Python 2 a timed wait polls with a growing interval of
+					# up to 50ms, so an earlier event scheduled meanwhile
+					# could otherwise go out that late. An untimed wait, as
+					# above, wakes as soon as it's notified.
+					self.lock.wait (min (remaining - self.resolution, self.maxWait))
+					continue
+				if remaining <= 0:
+					event = heapq.heappop (self.events)
+					message, key = event[2], event[3]
+					if key != None and self.pending.get (key) is event:
+						del self.pending[key]
+				else:
+					message = None
+			if message != None:
+				self.send (message)
+			elif remaining > 0:
+				# Sleep the rest of the way, which is shorter than the
+				# resolution, outside the lock.
+				time.sleep (remaining)
@@ -0,0 +1,165 @@
+''' profiling.py - Tools for measuring ricercar's hot paths.
+'''
+
+import gc, json, os, sys, threading, time
+from collections import deque
+
+from config import *
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+class AllocationCounter:
+	''' Measures how much memory a piece of code allocates, including blocks
+	it frees again before it's done, such as per-frame matrix headers.
+
+	Call Start once, then Begin and End around each run of the code. End
+	returns the peak number of bytes allocated above what was allocated at
+	Begin. Uses tracemalloc where it is available (Python 3.4+).
+
+	Python 2 has no way of seeing memory that is freed again, so there End
+	returns the net number of objects tracked by the garbage collector
+	instead. That only sees container objects, and only those left behind,
+	so it can spot leaks but not transient allocations.
+	'''
+	def __init__ (self):
+		self.startCount = 0
+		self.startedTracing = False
+
+	def Start (self):
+		if tracemalloc != None and not tracemalloc.is_tracing ():
+			tracemalloc.start ()
+			self.startedTracing = True
+
+	def Stop (self):
+		if self.startedTracing:
+			tracemalloc.stop ()
+			self.startedTracing = False
+
+	def Begin (self):
+		if tracemalloc == None:
+			gc.collect ()
+			self.startCount = len (gc.get_objects ())
+		elif hasattr (tracemalloc, 'reset_peak'):
+			tracemalloc.reset_peak ()
+			self.startCount = tracemalloc.get_traced_memory ()[0]
+		else:
+			# Before Python 3.9 the peak can only be reset along with the traces.
+			tracemalloc.clear_traces ()
+			self.startCount = 0
+
+	def End (self):
+		if tracemalloc == None:
+			gc.collect ()
+			return len (gc.get_objects ()) - self.startCount
+		return tracemalloc.get_traced_memory ()[1] - self.startCount
+
+# Highest-resolution clock available. On Python 2 under Windows time.time
+# only ticks every ~15ms, but time.clock is a performance counter.
+if hasattr (time, 'perf_counter'): Now = time.perf_counter
+elif sys.platform == 'win32': Now = time.clock
+else: Now = time.time
+
+class NullSpan:
+	''' What Profiler.Span returns while profiling is off. '''
+	def __enter__ (self): pass
+	def __exit__ (self, *exc): pass
+
+NULL_SPAN = NullSpan ()
+
+class SpanTimer:
+	''' Times one named stage. Reused for every span of that name, so
+	timing a stage doesn't allocate. Not reentrant. '''
+	def __init__ (self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+		self.start = 0.0
+
+	def __enter__ (self):
+		self.start = Now ()
+
+	def __exit__ (self, *exc):
+		self.profiler.Record (self.name, self.start, Now ())
+
+class Profiler:
+	''' Collects per-stage timings for the main loop.
+
+	Wrap each stage in a span:
+
+		with profiler.Span ("tracker"):
+			tracker.Tick (timeElapsed)
+
+	Recent durations are kept per stage for min/mean/p99 summaries, and if
+	tracing is on every span is also kept for export in the Chrome trace
+	event format (chrome://tracing). While disabled, Span returns a shared
+	do-nothing object.
+	'''
+	def __init__ (self, enabled=PROFILE_ENABLED, history=PROFILE_HISTORY, tracing=PROFILE_TRACE_FILE != None):
+		self.enabled = enabled
+		self.history = history
+		self.tracing = tracing
+		self.timers = {}
+		self.names = [] # Stage names in order of first appearance
+		self.durations = {}
+		self.trace = deque (maxlen=PROFILE_TRACE_LIMIT)
+		self.summary = []
+		self.summaryTime = 0.0
+		self.epoch = Now ()
+
+	def Span (self, name):
+		if not self.enabled: return NULL_SPAN
+		timer = self.timers.get (name)
+		if timer == None:
+			timer = self.timers[name] = SpanTimer (self, name)
+			self.AddStage (name)
+		return timer
+
+	def AddStage (self, name):
+		self.names.append (name)
+		self.durations[name] = deque (maxlen=self.history)
+
+	def Record (self, name, start, end):
+		''' Records that stage name ran from start to end. Can also be used
+		directly for intervals that don't fit a with block, e.g.: latencies. '''
+		if not name in self.durations: self.AddStage (name)
+		self.durations[name].append (end - start)
+		if self.tracing:
+			self.trace.append ((name, start, end, threading.current_thread ().ident))
+
+	def GetSummary (self, interval=0.5):
+		''' Returns (name, min, mean, p99, count) for each stage, in
+		milliseconds. Recalculated at most once per interval seconds. '''
+		now = Now ()
+		if now - self.summaryTime < interval: return self.summary
+		self.summaryTime = now
+		summary = []
+		for name in self.names:
+			samples = sorted (self.durations[name])
+			n = len (samples)
+			if n == 0: continue
+			summary.append ((name,
+				samples[0]*1000.0,
+				sum (samples)*1000.0/n,
+				samples[min (n-1, int(n*0.99))]*1000.0,
+				n))
+		self.summary = summary
+		return summary
+
+	def ExportTrace (self, path):
+		''' Writes the recorded spans as a Chrome trace event file. '''
+		pid = os.getpid ()
+		events = [{
+			"name": name,
+			"ph": "X",
+			"ts": (start - self.epoch) * 1e6,
+			"dur": (end - start) * 1e6,
+			"pid": pid,
+			"tid": tid,
+		} for name, start, end, tid in self.trace]
+		with open (path, "w") as f:
+			json.dump ({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+# Shared by the whole application.
+profiler = Profiler ()
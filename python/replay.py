@@ -0,0 +1,89 @@
+''' replay.py - Runs ricercar's detection and tracking over a recording.
+
+Usage: python replay.py [options] <video file or directory of frames>
+
+Frames are processed as fast as possible with no window, camera or MIDI
+device, and the tracker is driven by a virtual clock that advances one
+frame interval per frame, so a given recording produces the same result
+on every run. Prints throughput figures when done.
+'''
+
+import sys, time
+from optparse import OptionParser
+
+from config import *
+from imgproc import StreamProcessor
+from arrayproc import ArrayStreamProcessor
+from tracker import Tracker
+from MIDIio import MIDIDevice
+from midibackend import LoopbackBackend, RecordingBackend
+from timing import ReplayClock
+
+class Replay:
+	def __init__ (self, source, frameRate=None, midiPort=None, backend=IMGPROC_BACKEND, recordFile=None):
+		# MIDI goes to a port if one is given, to a file if recording, and
+		# otherwise nowhere, so no MIDI system is needed.
+		if recordFile != None:
+			midiBackend = RecordingBackend (recordFile)
+			midiPort = 0
+		elif midiPort != None: midiBackend = None
+		else: midiBackend = LoopbackBackend ()
+		# Note-offs follow the virtual clock, not the wall clock.
+		self.midiOut = MIDIDevice (mode=MIDIDevice.MODE_OUTPUT, scheduled=False, backend=midiBackend)
+		self.midiOut.controlInterval = 0
+		if midiPort != None: self.midiOut.OpenPort (midiPort)
+		self.tracker = Tracker (self.midiOut)
+		if backend == "cv2":
+			self.streamProc = ArrayStreamProcessor (self.tracker, threadedCapture=False)
+		else:
+			self.streamProc = StreamProcessor (self.tracker, threadedCapture=False)
+		self.streamProc.SetVideoSource (deviceID=source)
+		if not self.streamProc.capture:
+			raise IOError ("Couldn't open %s" % source)
+		if frameRate == None: frameRate = self.streamProc.streamFPS
+		self.clock = ReplayClock (frameRate)
+		self.streamProc.SetClock (self.clock)
+
+	def Run (self, maxFrames=None):
+		''' Processes frames until the recording ends. Returns the number of
+		frames processed and the number of marker detections. '''
+		nFrames = 0
+		nDetections = 0
+		while maxFrames == None or nFrames < maxFrames:
+			self.clock.Tick ()
+			self.streamProc.Tick ()
+			if self.streamProc.endOfStream: break
+			self.tracker.Tick (self.clock.tickTime)
+			self.midiOut.Tick ()
+			nFrames += 1
+			nDetections += sum (1 for marker in self.tracker.markers if marker.visible)
+		return nFrames, nDetections
+
+	def Close (self):
+		self.midiOut.Close ()
+
+if __name__ == "__main__":
+	parser = OptionParser (usage="%prog [options] <video file or frame directory>")
+	parser.add_option ("-r", "--rate", type="float", dest="frameRate",
+		help="frame rate of the recording, if the file doesn't say")
+	parser.add_option ("-n", "--frames", type="int", dest="maxFrames",
+		help="stop after this many frames")
+	parser.add_option ("-m", "--midi-port", type="int", dest="midiPort",
+		help="send MIDI output to this port")
+	parser.add_option ("-o", "--record", dest="recordFile",
+		help="write timestamped MIDI output to this file")
+	parser.add_option ("-b", "--backend", dest="backend", default=IMGPROC_BACKEND,
+		help="image processing backend: cv or cv2")
+	options, args = parser.parse_args ()
+	if len(args) != 1:
+		parser.print_help ()
+		sys.exit (1)
+	replay = Replay (args[0], options.frameRate, options.midiPort, options.backend, options.recordFile)
+	start = time.time ()
+	nFrames, nDetections = replay.Run (options.maxFrames)
+	replay.Close ()
+	elapsed = time.time () - start
+	print "Processed %i frames in %.2fs (%.1f frames/s)" % (
+		nFrames, elapsed, nFrames/elapsed if elapsed > 0 else 0)
+	print "%i marker detections, %.2f per frame" % (
+		nDetections, float(nDetections)/nFrames if nFrames else 0)
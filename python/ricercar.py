@@ -4,30 +4,14 @@ import pygame
 
 from config import *
 from imgproc import StreamProcessor
+from arrayproc import ArrayStreamProcessor
+from imgworker import ProcessStreamProcessor
 from tracker import Marker, Tracker
 from MIDIio import MIDIDevice
 from ui import MainWindow
-
-class FrameTimer:
-	def __init__ (self):
-		self.nFrame = 0
-		self.fps = 0
-		self.countStart = time.time ()
-		self.lastFrame = self.countStart
-		self.tickTime = 0.001 # Avoids divide-by-zero errors
-
-	def Tick (self):
-		self.nFrame += 1
-		now = time.time ()
-		self.tickTime = now - self.lastFrame
-		self.lastFrame = now
-		
-		# Recalculate FPS after every 30 frames
-		if self.nFrame >= 30:
-			elapsed = now - self.countStart
-			self.fps = float(self.nFrame)/elapsed
-			self.countStart = time.time ()
-			self.nFrame = 0
+from timing import FrameTimer
+from profiling import profiler
+from smfrecord import SMFRecorder
 
 class Scheduler:
 	''' Provides the main loop functionality for ricercar. '''
@@ -37,10 +21,19 @@ class Scheduler:
 		midiIn = self.midiIn = MIDIDevice (mode=MIDIDevice.MODE_INPUT)
 		midiOut.OpenPort (MIDI_OUT_DEVICE)
 		midiIn.OpenPort (MIDI_IN_DEVICE)
+		self.recorder = None
+		if MIDI_SMF_FILE != None:
+			self.recorder = midiOut.recorder = SMFRecorder (time.strftime (MIDI_SMF_FILE))
+			self.recorder.Start ()
 		# GUI, Tracker, Image processing
 		tracker = self.tracker = Tracker (midiOut)
 		self.midiIn.SetTracker (self.tracker)
-		self.streamProc = StreamProcessor (self.tracker)
+		if IMGPROC_PROCESS:
+			self.streamProc = ProcessStreamProcessor (self.tracker)
+		elif IMGPROC_BACKEND == "cv2":
+			self.streamProc = ArrayStreamProcessor (self.tracker)
+		else:
+			self.streamProc = StreamProcessor (self.tracker)
 		window = self.window = MainWindow (
 			scheduler = self,
 			tracker = self.tracker,
@@ -63,11 +56,16 @@ class Scheduler:
 		while self.running:
 			# Send heartbeat
 			self.frameTimer.Tick ()
-			self.streamProc.Tick ()
-			self.tracker.Tick (self.frameTimer.tickTime)
-			self.midiOut.Tick ()
-			self.midiIn.Tick ()
-			self.window.Tick ()
+			with profiler.Span ("imgproc"):
+				self.streamProc.Tick ()
+			with profiler.Span ("tracker"):
+				self.tracker.Tick (self.frameTimer.tickTime)
+			with profiler.Span ("midi out"):
+				self.midiOut.Tick ()
+			with profiler.Span ("midi in"):
+				self.midiIn.Tick ()
+			with profiler.Span ("render"):
+				self.window.Tick ()
 
 			# Input loop
 			for event in pygame.event.get ():
@@ -83,6 +81,12 @@ class Scheduler:
 
 	def Stop (self):
 		self.running = False
+		self.streamProc.StopCapture ()
+		self.midiOut.Close ()
+		self.midiIn.Close ()
+		if self.recorder != None: self.recorder.Stop ()
+		if PROFILE_TRACE_FILE != None and profiler.enabled:
+			profiler.ExportTrace (PROFILE_TRACE_FILE)
 		print "Stopping ricercar..."
 		pygame.display.quit ()
 		sys.exit ()
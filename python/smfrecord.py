@@ -0,0 +1,112 @@
+''' smfrecord.py - Records MIDI output to a Standard MIDI File as it's sent.
+
+MIDIDevice hands each message it sends to SMFRecorder.Put, which only
+appends it to a deque. A writer thread drains the deque every few seconds,
+encodes the new events onto one track per MIDI channel and rewrites the
+file, so the tick loop never waits on the disk and a crash loses at most
+one flush interval of the performance.
+'''
+
+import os, struct, threading
+from collections import deque
+
+from profiling import Now
+import config
+
+TEMPO = 500000 # Microseconds per quarter note, i.e.: 120 bpm
+
+def VariableLength (value):
+	''' Encodes value as an SMF variable-length quantity. '''
+	data = [value & 0x7F]
+	value >>= 7
+	while value:
+		data.append ((value & 0x7F) | 0x80)
+		value >>= 7
+	return bytearray (reversed (data))
+
+def MetaEvent (eventType, data):
+	return bytearray ([0x00, 0xFF, eventType]) + VariableLength (len(data)) + bytearray (data)
+
+def Chunk (chunkType, data):
+	return chunkType + struct.pack ('>I', len(data)) + bytes (data)
+
+class SMFRecorder:
+	def __init__ (self, path, flushInterval=config.MIDI_SMF_FLUSH_INTERVAL, division=960):
+		self.path = path
+		self.flushInterval = flushInterval
+		self.division = division
+		self.ticksPerSecond = division * 1000000.0 / TEMPO
+		self.queue = deque ()
+		self.start = None
+		self.tracks = {} # channel -> [encoded events, time of last event in ticks]
+		self.running = False
+		self.wakeup = threading.Event ()
+		self.thread = None
+
+	def Start (self):
+		if self.running: return
+		self.start = Now ()
+		self.running = True
+		self.thread = threading.Thread (target=self.Run, name="SMFRecorder")
+		self.thread.daemon = True
+		self.thread.start ()
+
+	def Stop (self):
+		''' Stops the writer thread after a final write. '''
+		if not self.running: return
+		self.running = False
+		self.wakeup.set ()
+		self.thread.join ()
+		self.thread = None
+
+	def Put (self, message, when):
+		''' Queues a message sent at time when (see profiling.Now). Called
+		from whichever thread is sending. '''
+		self.queue.append ((when, message))
+
+	def Run (self):
+		while self.running:
+			self.wakeup.wait (self.flushInterval)
+			if self.Drain (): self.Write ()
+		if self.Drain (): self.Write ()
+
+	def Drain (self):
+		''' Encodes queued messages onto their tracks. Returns True if there
+		were any. '''
+		nEvents = 0
+		while True:
+			try:
+				when, message = self.queue.popleft ()
+			except IndexError:
+				break
+			status = int(message[0])
+			if status >= 0xF0: continue # Only channel messages are recorded.
+			track = self.tracks.get (status & 0x0F)
+			if track == None: track = self.tracks[status & 0x0F] = [bytearray (), 0]
+			tick = max (track[1], int(round ((when - self.start) * self.ticksPerSecond)))
+			track[0] += VariableLength (tick - track[1])
+			track[0] += bytearray (int(b) & 0xFF for b in message)
+			track[1] = tick
+			nEvents += 1
+		return nEvents > 0
+
+	def Write (self):
+		''' Writes a type 1 file: a tempo track, then one track per channel. '''
+		tempoTrack = MetaEvent (0x51, struct.pack ('>I', TEMPO)[1:]) + MetaEvent (0x2F, '')
+		data = [Chunk ('MThd', struct.pack ('>HHH', 1, 1 + len(self.tracks), self.division)),
+			Chunk ('MTrk', tempoTrack)]
+		for channel in sorted (self.tracks):
+			events = self.tracks[channel][0]
+			name = MetaEvent (0x03, "Channel %i" % (channel + 1))
+			data.append (Chunk ('MTrk', name + events + MetaEvent (0x2F, '')))
+		# Write alongside and swap in, so the file on disk is always whole.
+		temp = self.path + ".part"
+		f = open (temp, "wb")
+		f.write ("".join (data))
+		f.close ()
+		try:
+			os.rename (temp, self.path)
+		except OSError:
+			# Windows won't rename over an existing file.
+			os.remove (self.path)
+			os.rename (temp, self.path)
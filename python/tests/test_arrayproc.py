@@ -0,0 +1,66 @@
+''' test_arrayproc.py - Marker detection by ArrayStreamProcessor on synthetic frames.
+'''
+
+import unittest
+import cv2
+
+from config import *
+from tracker import Tracker
+from arrayproc import ArrayStreamProcessor
+from bench.common import NullMIDIOut
+from bench.frames import SyntheticFrame, DISC_COLOURS
+
+# One disc per default marker, in tracker order: red, green, blue, yellow.
+CENTRES = [(60,50), (250,60), (80,190), (200,160)]
+RADIUS = 8
+TOLERANCE = 3.0 # Grid pixels
+
+class ArrayStreamProcessorTest (unittest.TestCase):
+	def setUp (self):
+		self.tracker = Tracker (NullMIDIOut ())
+
+	def Process (self, frame, classifier=True):
+		proc = ArrayStreamProcessor (self.tracker, threadedCapture=False)
+		if not classifier: proc.classifier = None
+		proc.ProcessFrame (frame, 1.0)
+
+	def assertFoundAt (self, marker, centre):
+		self.assertTrue (marker.visible, "%s not found" % marker.name)
+		self.assertAlmostEqual (marker.tX*GRID_SIZE[0], centre[0], delta=TOLERANCE)
+		self.assertAlmostEqual (marker.tY*GRID_SIZE[1], centre[1], delta=TOLERANCE)
+		self.assertEqual (marker.tTime, 1.0)
+
+	def testMarkerPositions (self):
+		for classifier in (True, False):
+			self.tracker = Tracker (NullMIDIOut ())
+			self.Process (SyntheticFrame (tuple(GRID_SIZE), radius=RADIUS, centres=CENTRES), classifier)
+			for marker, centre in zip (self.tracker.markers, CENTRES):
+				self.assertFoundAt (marker, centre)
+
+	def testMissingMarker (self):
+		self.Process (SyntheticFrame (tuple(GRID_SIZE), radius=RADIUS, centres=CENTRES[:2]))
+		self.assertTrue (self.tracker.markers[1].visible)
+		self.assertFalse (self.tracker.markers[2].visible)
+		self.assertFalse (self.tracker.markers[3].visible)
+
+	def testSameColourMarkers (self):
+		''' Two markers of one colour each find their own disc, rather than
+		both landing between them. '''
+		yellow = self.tracker.markers[3]
+		clone = self.tracker.CloneMarker (yellow, 2)
+		self.tracker.markers.append (clone)
+		other = (90, 100)
+		frame = SyntheticFrame (tuple(GRID_SIZE), radius=RADIUS, centres=CENTRES)
+		cv2.circle (frame, other, RADIUS, DISC_COLOURS[3], -1)
+		for classifier in (True, False):
+			yellow.Disable ()
+			clone.Disable ()
+			self.Process (frame, classifier)
+			found = sorted ((m.tX*GRID_SIZE[0], m.tY*GRID_SIZE[1]) for m in (yellow, clone) if m.visible)
+			self.assertEqual (len(found), 2)
+			for (x, y), centre in zip (found, sorted ([other, CENTRES[3]])):
+				self.assertAlmostEqual (x, centre[0], delta=TOLERANCE)
+				self.assertAlmostEqual (y, centre[1], delta=TOLERANCE)
+
+if __name__ == '__main__':
+	unittest.main ()
@@ -0,0 +1,41 @@
+''' test_crossings.py - NoteMarker's string crossings against a linear scan.
+'''
+
+import random, unittest
+
+from config import *
+from tracker import Tracker, NoteMarker, String
+from MIDIio import MIDIDevice
+from midibackend import LoopbackBackend
+
+def Crossed (strings, x0, x1):
+	''' Indices of the strings lying strictly between x0 and x1, found the
+	way NoteMarker.Tick used to: by testing every string. '''
+	return [i for i, string in enumerate (strings)
+		if (x0 < string.x and x1 > string.x) or (x0 > string.x and x1 < string.x)]
+
+class CrossingTest (unittest.TestCase):
+	def testRandomMoves (self):
+		rng = random.Random (0)
+		midiOut = MIDIDevice (mode=MIDIDevice.MODE_OUTPUT, scheduled=False, backend=LoopbackBackend ())
+		midiOut.OpenPort (0)
+		tracker = Tracker (midiOut)
+		marker = tracker.markers[1] # Legato: one note per string plucked.
+		self.assertEqual (marker.mode, NoteMarker.MODE_LEGATO)
+		for i in range (500):
+			nStrings = rng.randint (0, 12)
+			positions = [round (rng.random (), 2) for j in range (nStrings)]
+			marker.SetStrings ([String (x, j) for j, x in enumerate (positions)])
+			x0 = round (rng.random (), 2)
+			x1 = rng.choice ([round (rng.random (), 2), x0] + positions)
+			expected = Crossed (marker.strings, x0, x1)
+			marker.Enable ()
+			marker.Target (x0, 0.5)
+			marker.Tick (1/30.0)
+			marker.Target (x1, 0.5)
+			marker.Tick (1/30.0)
+			plucked = [j for j, string in enumerate (marker.strings) if string.activeNotes]
+			self.assertEqual (plucked, expected, "strings %r, %r -> %r" % (positions, x0, x1))
+
+if __name__ == '__main__':
+	unittest.main ()
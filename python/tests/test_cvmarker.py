@@ -0,0 +1,32 @@
+''' test_cvmarker.py - CVMarker's output modes for each axis.
+'''
+
+import unittest
+
+import tracker
+from tracker import CVMarker
+
+class CVMarkerTest (unittest.TestCase):
+	def setUp (self):
+		self.defaults = (tracker.MARKER_CV_DEFAULT_X_MODE, tracker.MARKER_CV_DEFAULT_Y_MODE)
+
+	def tearDown (self):
+		tracker.MARKER_CV_DEFAULT_X_MODE, tracker.MARKER_CV_DEFAULT_Y_MODE = self.defaults
+
+	def testDefaultModes (self):
+		tracker.MARKER_CV_DEFAULT_X_MODE = CVMarker.MODE_PITCH_BEND
+		tracker.MARKER_CV_DEFAULT_Y_MODE = CVMarker.MODE_PITCH_BEND
+		# y can't share x's pitch bend on one channel, so it falls back.
+		marker = CVMarker (xChannel=3, yChannel=3)
+		self.assertEqual ((marker.xMode, marker.yMode), (CVMarker.MODE_PITCH_BEND, CVMarker.MODE_CC))
+		marker = CVMarker (xChannel=3, yChannel=4)
+		self.assertEqual ((marker.xMode, marker.yMode), (CVMarker.MODE_PITCH_BEND, CVMarker.MODE_PITCH_BEND))
+
+	def testClash (self):
+		self.assertRaises (ValueError, CVMarker, xChannel=3, yChannel=3,
+			xMode=CVMarker.MODE_PITCH_BEND, yMode=CVMarker.MODE_PITCH_BEND)
+		self.assertRaises (ValueError, CVMarker, xController=5, yController=5)
+		CVMarker (xController=5, yController=5, xMode=CVMarker.MODE_CC, yMode=CVMarker.MODE_PITCH_BEND)
+
+if __name__ == '__main__':
+	unittest.main ()
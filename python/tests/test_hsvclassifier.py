@@ -0,0 +1,81 @@
+''' test_hsvclassifier.py - HSVClassifier against per-range thresholding.
+'''
+
+import unittest
+import numpy as np
+
+from config import *
+from tracker import HSVColourRange
+from imgproc import HSVClassifier
+
+def Threshold (hsv, cRange):
+	''' The mask cv.InRangeS makes for cRange: lower bounds inclusive, upper
+	bounds exclusive, with red's second hue range added. '''
+	h, s, v = hsv[...,0], hsv[...,1], hsv[...,2]
+	hue = (h >= cRange.hue[0]) & (h < cRange.hue[1])
+	if cRange.hue2 != None:
+		hue |= (h >= cRange.hue2[0]) & (h < cRange.hue2[1])
+	inRange = (hue & (s >= cRange.saturation[0]) & (s < cRange.saturation[1])
+		& (v >= cRange.value[0]) & (v < cRange.value[1]))
+	return inRange.astype (np.uint8) * 255
+
+class HSVClassifierTest (unittest.TestCase):
+	def setUp (self):
+		random = np.random.RandomState (0)
+		self.hsv = random.randint (0, 256, (48,64,3)).astype (np.uint8)
+		self.hsv[...,0] %= 180
+		self.ranges = [
+			HSVColourRange (SN_RHUE, SN_RSAT, SN_RVAL, SN_RHUE2),
+			HSVColourRange (SN_GHUE, SN_GSAT, SN_GVAL),
+			HSVColourRange (SN_BHUE, SN_BSAT, SN_BVAL),
+			HSVColourRange (SN_YHUE, SN_YSAT, SN_YVAL),
+			HSVColourRange ([10.5,40], [0,256], [100,200.5]),
+		]
+
+	def Masks (self, n):
+		return [np.zeros ((48,64), dtype=np.uint8) for i in range (n)]
+
+	def Classify (self, ranges, masks, **kwargs):
+		classifier = HSVClassifier ((64,48), len(ranges))
+		classifier.Update (ranges)
+		classifier.Classify (self.hsv, masks, **kwargs)
+
+	def testMatchesThreshold (self):
+		masks = self.Masks (len(self.ranges))
+		self.Classify (self.ranges, masks)
+		for cRange, mask in zip (self.ranges, masks):
+			self.assertTrue ((mask == Threshold (self.hsv, cRange)).all ())
+
+	def testRangeChange (self):
+		masks = self.Masks (len(self.ranges))
+		classifier = HSVClassifier ((64,48), len(self.ranges))
+		classifier.Update (self.ranges)
+		self.ranges[1].saturation[0] += 40
+		classifier.Update (self.ranges)
+		classifier.Classify (self.hsv, masks)
+		self.assertTrue ((masks[1] == Threshold (self.hsv, self.ranges[1])).all ())
+
+	def testWindow (self):
+		masks = self.Masks (len(self.ranges))
+		self.Classify (self.ranges, masks, rect=(10,5,20,30), indices=(0,))
+		expected = np.zeros ((48,64), dtype=np.uint8)
+		expected[5:35,10:30] = Threshold (self.hsv, self.ranges[0])[5:35,10:30]
+		self.assertTrue ((masks[0] == expected).all ())
+		self.assertFalse (masks[1].any ())
+
+	def testManyClones (self):
+		''' More markers than bits in a uint32, sharing a few ranges and, as
+		clones do, their masks. '''
+		ranges = [self.ranges[i % len(self.ranges)] for i in range (40)]
+		shared = self.Masks (len(self.ranges))
+		masks = [shared[i % len(self.ranges)] for i in range (40)]
+		self.Classify (ranges, masks)
+		for cRange, mask in zip (ranges, masks):
+			self.assertTrue ((mask == Threshold (self.hsv, cRange)).all ())
+		# Separate masks for each marker, too.
+		masks = self.Masks (len(ranges))
+		self.Classify (ranges, masks, indices=(39,))
+		self.assertTrue ((masks[39] == Threshold (self.hsv, ranges[39])).all ())
+
+if __name__ == '__main__':
+	unittest.main ()
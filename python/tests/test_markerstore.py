@@ -0,0 +1,115 @@
+''' test_markerstore.py - Tracker.Tick with a MarkerStore against per-marker ticks.
+'''
+
+import random, unittest
+
+import MIDIio
+from config import *
+from tracker import Tracker, NoteMarker, CVMarker, String, MarkerStore, AlphaBetaFilter
+from MIDIio import MIDIDevice
+from midibackend import LoopbackBackend
+
+def Output (log):
+	''' A loopback output sending messages to log. '''
+	midiOut = MIDIDevice (mode=MIDIDevice.MODE_OUTPUT, scheduled=False, batched=False, backend=LoopbackBackend ())
+	midiOut.OpenPort (0)
+	midiOut.device.send_message = lambda message: log.append ([round (b, 6) for b in message])
+	return midiOut
+
+class MarkerStoreTest (unittest.TestCase):
+	def setUp (self):
+		self.now = 100.0
+		self.realNow = MIDIio.Now
+		MIDIio.Now = lambda: self.now
+
+	def tearDown (self):
+		MIDIio.Now = self.realNow
+
+	def BuildTracker (self, store):
+		log = []
+		midiOut = Output (log)
+		tracker = Tracker (midiOut)
+		tracker.store = MarkerStore (midiOut) if store else None
+		rng = random.Random (1)
+		for marker in tracker.markers[:3]:
+			marker.SetStrings ([String (round (rng.random (), 2), j) for j in range (rng.randint (0, 8))])
+		tracker.markers.append (tracker.CloneMarker (tracker.markers[1], 2))
+		tracker.markers.append (tracker.CloneMarker (tracker.markers[3], 2))
+		tracker.markers[-1].xMode = CVMarker.MODE_CC_14BIT
+		tracker.markers[-1].yMode = CVMarker.MODE_PITCH_BEND
+		tracker.markers[0].motionFilter = AlphaBetaFilter ()
+		return tracker, log
+
+	def Run (self, store):
+		''' Random targets and disappearances, with strings, output settings
+		and markers changed part way. Returns the MIDI output of each frame,
+		and the final marker states. '''
+		tracker, log = self.BuildTracker (store)
+		rng = random.Random (0)
+		frameTime = 50.0
+		self.now = 100.0
+		frames = []
+		for i in range (400):
+			frameTime += 1/30.0
+			self.now += 1/60.0
+			if i == 100: tracker.markers[1].SetStrings ([String (0.5, 0), String (0.25, 1)])
+			if i == 150: tracker.markers[3].xController = 7
+			if i == 200: tracker.markers[2] = tracker.CloneMarker (tracker.markers[2], 3)
+			if i == 250: del tracker.markers[4]
+			if i == 300: tracker.midiOut.OpenPort (0)
+			for marker in tracker.markers:
+				# Hold still while the output changes, so only that is sent.
+				if (i == 150 or i == 300) and marker.visible: continue
+				if rng.random () < 0.05: marker.Disable ()
+				elif rng.random () < 0.9: marker.Target (rng.random (), rng.random (), frameTime if rng.random () < 0.8 else None)
+			tracker.Tick (1/60.0)
+			tracker.midiOut.Tick ()
+			# Controller values held back by rate limiting may go out at
+			# the end of the frame rather than with the marker's tick.
+			frames.append (sorted (log))
+			del log[:]
+		states = [[getattr (marker, name) for name in MarkerStore.FIELDS + MarkerStore.FLAGS]
+			for marker in tracker.markers]
+		return frames, states
+
+	def testSameAsMarkerTick (self):
+		frames, states = self.Run (store=False)
+		storeFrames, storeStates = self.Run (store=True)
+		self.assertTrue (sum (len(frame) for frame in frames) > 400)
+		for i, (frame, storeFrame) in enumerate (zip (frames, storeFrames)):
+			self.assertEqual (storeFrame, frame, "frame %i" % i)
+		self.assertEqual (len(storeStates), len(states))
+		for state, storeState in zip (states, storeStates):
+			for a, b in zip (state, storeState):
+				if isinstance (a, float): self.assertAlmostEqual (a, b)
+				else: self.assertEqual (a, b)
+
+	def testDetach (self):
+		tracker, log = self.BuildTracker (store=True)
+		marker = tracker.markers[0]
+		marker.Target (0.25, 0.75, 3.0)
+		tracker.Tick (1/60.0)
+		self.assertTrue (marker.stored)
+		tracker.markers[0] = tracker.CloneMarker (marker, 2)
+		tracker.Tick (1/60.0)
+		self.assertFalse (marker.stored)
+		self.assertTrue (type (marker) is NoteMarker)
+		self.assertEqual ((marker.x, marker.y, marker.time), (0.25, 0.75, 3.0))
+	def testSameFrame (self):
+		for store in (False, True):
+			tracker, log = self.BuildTracker (store)
+			marker = tracker.markers[1] # No motion filter
+			marker.Target (0.25, 0.5, 3.0)
+			tracker.Tick (1/60.0)
+			marker.Target (0.5, 0.5, 3.5)
+			tracker.Tick (1/60.0)
+			self.assertAlmostEqual (marker.vx, 0.5)
+			# Ticks without a new frame leave the velocity alone.
+			tracker.Tick (1/60.0)
+			marker.Target (0.5, 0.5, 3.5)
+			tracker.Tick (1/60.0)
+			self.assertAlmostEqual (marker.vx, 0.5)
+			self.assertEqual ((marker.pX, marker.x, marker.time), (0.5, 0.5, 3.5))
+
+if __name__ == '__main__':
+	unittest.main ()
@@ -0,0 +1,159 @@
+''' test_midiio.py - MIDIDevice's controller and batched output, and input handling.
+'''
+
+import unittest
+
+import MIDIio
+from MIDIio import MIDIDevice, RunningStatus
+from midisched import MIDIScheduler
+from profiling import Now
+from midibackend import LoopbackBackend
+from tracker import Tracker
+from constants import MARKER_RED
+from MIDIConstants import *
+
+class FakePort:
+	''' Records sent messages in place of an rtmidi output port. '''
+	def __init__ (self):
+		self.sent = []
+
+	def send_message (self, message):
+		self.sent.append (list (message))
+
+	def close_port (self):
+		pass
+
+class ControlTest (unittest.TestCase):
+	def setUp (self):
+		self.now = 100.0
+		self.realNow = MIDIio.Now
+		MIDIio.Now = lambda: self.now
+		self.midiOut = MIDIDevice (mode=MIDIDevice.MODE_OUTPUT, scheduled=False)
+		self.port = self.midiOut.device = FakePort ()
+		self.midiOut.state = MIDIDevice.STATE_CONNECTED
+		self.interval = self.midiOut.controlInterval
+
+	def tearDown (self):
+		MIDIio.Now = self.realNow
+
+	def Sent (self):
+		self.midiOut.FlushOutput ()
+		sent = self.port.sent
+		self.port.sent = []
+		return sent
+
+	def testSkipsUnchangedValues (self):
+		self.midiOut.SetControl (10, controller=2, channel=1)
+		self.now += self.interval * 2
+		self.midiOut.SetControl (10, controller=2, channel=1)
+		self.midiOut.SetControl (11, controller=3, channel=1)
+		self.assertEqual (self.Sent (), [[CONTINUOUS_CONTROLLER, 2, 10], [CONTINUOUS_CONTROLLER, 3, 11]])
+
+	def testRateLimit (self):
+		self.midiOut.SetControl (10, controller=2, channel=3)
+		self.now += self.interval / 4
+		self.midiOut.SetControl (20, controller=2, channel=3)
+		self.midiOut.SetControl (30, controller=2, channel=3)
+		self.midiOut.Tick ()
+		self.assertEqual (self.Sent (), [[CONTINUOUS_CONTROLLER + 2, 2, 10]])
+		# The latest held value goes out once the interval is up...
+		self.now += self.interval * 2
+		self.midiOut.Tick ()
+		self.assertEqual (self.Sent (), [[CONTINUOUS_CONTROLLER + 2, 2, 30]])
+		# ...and a held value that returns to the one sent is dropped.
+		self.now += self.interval / 4
+		self.midiOut.SetControl (40, controller=2, channel=3)
+		self.midiOut.SetControl (30, controller=2, channel=3)
+		self.now += self.interval * 2
+		self.midiOut.Tick ()
+		self.assertEqual (self.Sent (), [])
+
+	def testControl14 (self):
+		self.midiOut.SetControl14 (0x1234, controller=5, channel=2)
+		self.now += self.interval * 2
+		self.midiOut.SetControl14 (0x1235, controller=5, channel=2)
+		self.now += self.interval * 2
+		self.midiOut.SetControl14 (0x1335, controller=5, channel=2)
+		cc = CONTINUOUS_CONTROLLER + 1
+		self.assertEqual (self.Sent (), [
+			[cc, 5, 0x24], [cc, 37, 0x34], # MSB and LSB
+			[cc, 37, 0x35], # Same MSB: LSB only
+			[cc, 5, 0x26], [cc, 37, 0x35]])
+
+	def testPitchBend (self):
+		self.midiOut.SetPitchBend (8192, channel=4)
+		self.now += self.interval * 2
+		self.midiOut.SetPitchBend (16383, channel=4)
+		self.midiOut.SetControl (0, controller=0, channel=4)
+		self.assertEqual (self.Sent (), [
+			[PITCH_BEND + 3, 0x00, 0x40],
+			[PITCH_BEND + 3, 0x7F, 0x7F],
+			[CONTINUOUS_CONTROLLER + 3, 0, 0]])
+
+class BatchTest (unittest.TestCase):
+	def setUp (self):
+		self.midiOut = MIDIDevice (mode=MIDIDevice.MODE_OUTPUT, scheduled=False, batched=True)
+		self.port = self.midiOut.device = FakePort ()
+		self.midiOut.state = MIDIDevice.STATE_CONNECTED
+
+	def testFlushOnTick (self):
+		self.midiOut.NoteOn (60, 100, channel=0x90)
+		self.midiOut.SendControl (5, controller=1, channel=1)
+		self.assertEqual (self.port.sent, [])
+		self.midiOut.Tick ()
+		self.assertEqual (self.port.sent, [[0x90, 60, 100], [CONTINUOUS_CONTROLLER, 1, 5]])
+
+	def testShortScheduledNote (self):
+		self.midiOut.scheduler = MIDIScheduler (self.midiOut.SendNow)
+		self.midiOut.SendControl (5, controller=1, channel=1)
+		self.midiOut.SendNote (60, 100, 0, channel=0x90)
+		self.midiOut.scheduler.Flush ()
+		self.midiOut.Tick ()
+		self.assertEqual (self.port.sent, [[CONTINUOUS_CONTROLLER, 1, 5], [0x90, 60, 100], [0x90, 60, 0]])
+		# Buffered messages for other notes stay batched.
+		del self.port.sent[:]
+		self.midiOut.NoteOn (64, 100, channel=0x90)
+		self.midiOut.NoteOff (60, channel=0x90, at=Now ())
+		self.midiOut.scheduler.Flush ()
+		self.midiOut.Tick ()
+		self.assertEqual (self.port.sent, [[0x90, 60, 0], [0x90, 64, 100]])
+
+	def testRunningStatus (self):
+		self.midiOut.runningStatus = True
+		self.midiOut.NoteOn (60, 100, channel=0x90)
+		self.midiOut.NoteOn (64, 100, channel=0x90)
+		self.midiOut.Tick ()
+		self.assertEqual (self.port.sent, [[0x90, 60, 100, 64, 100]])
+
+	def testRunningStatusStream (self):
+		self.assertEqual (RunningStatus ([]), [])
+		self.assertEqual (RunningStatus ([
+			[0x90, 60, 100], [0x90, 60, 0], [0xB0, 1, 2],
+			[0x90, 62, 1], [0xF8], [0x90, 64, 1], [0x90, 65, 1]]),
+			[0x90, 60, 100, 60, 0, 0xB0, 1, 2, 0x90, 62, 1, 0xF8, 0x90, 64, 1, 65, 1])
+class InputTest (unittest.TestCase):
+	def setUp (self):
+		self.tracker = Tracker (None)
+		self.midiIn = MIDIDevice (mode=MIDIDevice.MODE_INPUT, useCallback=True, immediate=(CONTINUOUS_CONTROLLER,), backend=LoopbackBackend ())
+		self.midiIn.state = MIDIDevice.STATE_CONNECTED
+		self.midiIn.SetTracker (self.tracker)
+
+	def testRangeChangesWaitForTick (self):
+		saturation = self.tracker.markers[MARKER_RED].colourRange.saturation
+		start = saturation[0]
+		# Knob 2 turns red's saturation, handled as it arrives...
+		self.midiIn.OnMessage (([CONTINUOUS_CONTROLLER, 104, 66], 0))
+		self.assertEqual (len(self.midiIn.inputQueue), 0)
+		# ...but only applied on the main loop.
+		self.assertEqual (saturation[0], start)
+		self.midiIn.Tick ()
+		self.assertEqual (saturation[0], start + 2)
+
+	def testQueuedTypes (self):
+		self.midiIn.OnMessage (([NOTE_ON, 60, 100], 0))
+		self.assertEqual (len(self.midiIn.inputQueue), 1)
+		self.midiIn.Tick ()
+		self.assertEqual (len(self.midiIn.inputQueue), 0)
+
+if __name__ == '__main__':
+	unittest.main ()
@@ -0,0 +1,75 @@
+''' test_midisched.py - MIDIScheduler ordering, replacement and cancellation.
+'''
+
+import time, unittest
+
+from profiling import Now
+from midisched import MIDIScheduler
+
+class MIDISchedulerTest (unittest.TestCase):
+	def setUp (self):
+		self.sent = []
+		self.scheduler = MIDIScheduler (self.sent.append)
+
+	def tearDown (self):
+		self.scheduler.Stop ()
+
+	def testFlushOrder (self):
+		now = Now ()
+		self.scheduler.Schedule (now + 3, "c")
+		self.scheduler.Schedule (now + 1, "a")
+		self.scheduler.Schedule (now + 2, "b1")
+		self.scheduler.Schedule (now + 2, "b2")
+		self.scheduler.Flush ()
+		self.assertEqual (self.sent, ["a", "b1", "b2", "c"])
+		self.scheduler.Flush ()
+		self.assertEqual (len(self.sent), 4)
+
+	def testReplaceAndCancel (self):
+		now = Now ()
+		self.scheduler.Schedule (now + 1, "old", key=1)
+		self.scheduler.Schedule (now + 2, "new", key=1)
+		self.scheduler.Schedule (now + 1, "gone", key=2)
+		self.assertTrue (self.scheduler.Cancel (2))
+		self.assertFalse (self.scheduler.Cancel (2))
+		self.assertFalse (self.scheduler.Cancel (3))
+		self.scheduler.Flush ()
+		self.assertEqual (self.sent, ["new"])
+
+	def testFlushKeep (self):
+		now = Now ()
+		for i in range (6): self.scheduler.Schedule (now + i, i)
+		self.scheduler.Flush (keep=lambda message: message % 2 == 0)
+		self.assertEqual (self.sent, [0, 2, 4])
+
+	def testSendsWhenDue (self):
+		self.scheduler.Start ()
+		start = Now ()
+		self.scheduler.Schedule (start + 0.04, "b")
+		self.scheduler.Schedule (start + 0.02, "a")
+		self.scheduler.Schedule (start + 0.03, "x", key="x")
+		self.scheduler.Cancel ("x")
+		self.scheduler.Schedule (start - 1, "late")
+		time.sleep (0.01)
+		self.assertEqual (self.sent, ["late"])
+		deadline = start + 1
+		while len(self.sent) < 3 and Now () < deadline: time.sleep (0.005)
+		self.assertEqual (self.sent, ["late", "a", "b"])
+	def testEarlierEventWakes (self):
+		# Schedule an event ahead of one the thread is already waiting on,
+		# long enough in that a Python 2 timed wait would poll every 50ms.
+		# How late that poll notices it depends on its phase, so try a few.
+		times = []
+		self.scheduler.send = lambda message: times.append (Now ())
+		self.scheduler.Start ()
+		for i in range (5):
+			self.scheduler.Schedule (Now () + 10, "far", key="far")
+			time.sleep (0.1 + i * 0.011)
+			due = Now ()
+			self.scheduler.Schedule (due, "near")
+			deadline = due + 1
+			while len(times) == i and Now () < deadline: time.sleep (0.001)
+			self.assertTrue (times[i] - due < 0.015)
+
+if __name__ == '__main__':
+	unittest.main ()
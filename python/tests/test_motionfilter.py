@@ -0,0 +1,63 @@
+''' test_motionfilter.py - Alpha-beta and Kalman filtering of marker tracks.
+'''
+
+import random, unittest
+
+from tracker import AlphaBetaFilter, KalmanFilter, TimeStep, NewMotionFilter
+
+class MotionFilterTest (unittest.TestCase):
+	def Track (self, motionFilter, n, noise=0.0, seed=0):
+		''' Feeds motionFilter n frames of a marker moving at (0.3, -0.2)
+		widths per second, 30 frames a second. Returns its last output. '''
+		rng = random.Random (seed)
+		for i in range (n):
+			t = 5.0 + i/30.0
+			x = 0.1 + 0.3*i/30.0 + rng.gauss (0, noise)
+			y = 0.8 - 0.2*i/30.0 + rng.gauss (0, noise)
+			state = motionFilter.Update (x, y, t, 1/60.0)
+		return state
+
+	def testConvergence (self):
+		for motionFilter in [AlphaBetaFilter (), KalmanFilter ()]:
+			x, y, vx, vy = self.Track (motionFilter, 60)
+			self.assertAlmostEqual (x, 0.1 + 0.3*59/30.0, places=3)
+			self.assertAlmostEqual (y, 0.8 - 0.2*59/30.0, places=3)
+			self.assertAlmostEqual (vx, 0.3, places=2)
+			self.assertAlmostEqual (vy, -0.2, places=2)
+			px, py = motionFilter.Predict (0.5)
+			self.assertAlmostEqual (px, x + vx*0.5)
+			self.assertAlmostEqual (py, y + vy*0.5)
+
+	def testSmoothing (self):
+		''' With noisy detections, the filtered velocity stays near the true
+		one. '''
+		for motionFilter in [AlphaBetaFilter (), KalmanFilter ()]:
+			x, y, vx, vy = self.Track (motionFilter, 90, noise=0.002)
+			self.assertTrue (abs (vx - 0.3) < 0.1 and abs (vy + 0.2) < 0.1, (vx, vy))
+
+	def testSameFrame (self):
+		for motionFilter in [AlphaBetaFilter (), KalmanFilter ()]:
+			state = self.Track (motionFilter, 10)
+			# Ticking again without a new frame changes nothing.
+			self.assertEqual (motionFilter.Update (0.9, 0.9, 5.0 + 9/30.0, 1/60.0), state)
+
+	def testClear (self):
+		for motionFilter in [AlphaBetaFilter (), KalmanFilter ()]:
+			self.Track (motionFilter, 10)
+			motionFilter.Clear ()
+			self.assertFalse (motionFilter.initialised)
+			self.assertEqual (motionFilter.Update (0.5, 0.25, None, 1/60.0), (0.5, 0.25, 0.0, 0.0))
+
+	def testTimeStep (self):
+		self.assertEqual (TimeStep (None, 1.0, 0.02), 0.02)
+		self.assertEqual (TimeStep (1.0, None, 0.02), 0.02)
+		self.assertEqual (TimeStep (1.0, 1.0, 0.02), None)
+		self.assertAlmostEqual (TimeStep (1.0, 1.05, 0.02), 0.05)
+
+	def testNewMotionFilter (self):
+		self.assertEqual (NewMotionFilter (None), None)
+		self.assertTrue (isinstance (NewMotionFilter ("alphabeta"), AlphaBetaFilter))
+		self.assertTrue (isinstance (NewMotionFilter ("kalman"), KalmanFilter))
+
+if __name__ == '__main__':
+	unittest.main ()
@@ -0,0 +1,37 @@
+''' test_notetable.py - NoteTable against a plain dict of release times.
+'''
+
+import random, unittest
+
+from MIDIio import NoteTable
+
+class NoteTableTest (unittest.TestCase):
+	def testRandomOperations (self):
+		rng = random.Random (0)
+		table = NoteTable ()
+		held = {} # (channel, note) -> release time
+		now = 0.0
+		for i in range (5000):
+			channel = 0x90 + rng.randint (0, 2)
+			note = rng.randint (60, 72)
+			op = rng.random ()
+			if op < 0.5:
+				release = now + rng.random ()
+				table.Add (channel, note, release)
+				held[(channel, note)] = release
+			elif op < 0.7:
+				self.assertEqual (table.Remove (channel, note), (channel, note) in held)
+				held.pop ((channel, note), None)
+			elif op < 0.99:
+				now += rng.random () * 0.2
+				due = sorted ((release, key) for key, release in held.items () if release <= now)
+				self.assertEqual (table.Expire (now), [key for release, key in due])
+				for release, key in due: del held[key]
+			else:
+				self.assertEqual (table.Clear (), [key for release, key in sorted ((r, k) for k, r in held.items ())])
+				held = {}
+			self.assertEqual (len(table), len(held))
+			self.assertTrue ((channel, note) in table or not (channel, note) in held)
+
+if __name__ == '__main__':
+	unittest.main ()
@@ -0,0 +1,76 @@
+''' test_notetimer.py - Release of AUTORELEASE notes through the NoteTimer.
+'''
+
+import unittest
+
+from config import *
+from tracker import Tracker, NoteTimer, NoteMarker, String
+from MIDIio import MIDIDevice
+from midibackend import LoopbackBackend
+
+class ExpiryLog:
+	''' Stands in for a marker, recording the entries it's asked to expire. '''
+	def __init__ (self):
+		self.expired = []
+
+	def ExpireNote (self, entry):
+		self.expired.append (entry[4])
+
+class NoteTimerTest (unittest.TestCase):
+	def testOrder (self):
+		timer = NoteTimer ()
+		log = ExpiryLog ()
+		timer.Add (0.3, log, None, "c")
+		timer.Add (0.1, log, None, "a")
+		timer.Advance (0.05)
+		timer.Add (0.1, log, None, "b") # Due at 0.15
+		timer.Add (0.1, log, None, "b2")
+		timer.Advance (0.04)
+		self.assertEqual (log.expired, [])
+		timer.Advance (0.1)
+		self.assertEqual (log.expired, ["a", "b", "b2"])
+		timer.Advance (1.0)
+		self.assertEqual (log.expired, ["a", "b", "b2", "c"])
+		self.assertEqual (len(timer.heap), 0)
+
+	def testCancel (self):
+		timer = NoteTimer ()
+		log = ExpiryLog ()
+		entry = timer.Add (0.1, log, None, "a")
+		timer.Add (0.2, log, None, "b")
+		timer.Cancel (entry)
+		timer.Advance (0.5)
+		self.assertEqual (log.expired, ["b"])
+
+	def testAutoRelease (self):
+		sent = []
+		midiOut = MIDIDevice (mode=MIDIDevice.MODE_OUTPUT, scheduled=False, batched=False, backend=LoopbackBackend ())
+		midiOut.OpenPort (0)
+		midiOut.device.send_message = lambda message: sent.append (list (message))
+		tracker = Tracker (midiOut)
+		marker = tracker.markers[2]
+		self.assertEqual (marker.mode, NoteMarker.MODE_AUTORELEASE)
+		tracker.markers = [marker]
+		marker.SetStrings ([String (0.4, 0), String (0.6, 1)])
+		marker.duration = 0.1
+		marker.Enable ()
+		marker.Target (0.3, 0.5)
+		tracker.Tick (0.02)
+		marker.Target (0.5, 0.5) # Plucks the first string...
+		tracker.Tick (0.02)
+		marker.Target (0.7, 0.5) # ...and the second a little later.
+		tracker.Tick (0.05)
+		notes = [string.activeNotes[0] for string in marker.strings]
+		channel = 0x90 + marker.channel
+		self.assertEqual (sent, [[channel, notes[0], sent[0][2]], [channel, notes[1], sent[1][2]]])
+		del sent[:]
+		tracker.Tick (0.06) # 0.11s since the first pluck
+		self.assertEqual (sent, [[channel, notes[0], 0]])
+		self.assertEqual (marker.strings[0].activeNotes, [])
+		self.assertEqual (marker.strings[1].activeNotes, [notes[1]])
+		tracker.Tick (0.05)
+		self.assertEqual (sent, [[channel, notes[0], 0], [channel, notes[1], 0]])
+		self.assertEqual (marker.strings[1].activeNotes, [])
+
+if __name__ == '__main__':
+	unittest.main ()
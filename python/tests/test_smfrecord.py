@@ -0,0 +1,54 @@
+''' test_smfrecord.py - Standard MIDI File encoding by SMFRecorder.
+'''
+
+import os, shutil, struct, tempfile, unittest
+
+from smfrecord import SMFRecorder, VariableLength
+
+def ReadChunks (data):
+	''' Splits SMF data into a list of (type, data) chunks. '''
+	chunks = []
+	while len(data) > 0:
+		length = struct.unpack ('>I', data[4:8])[0]
+		chunks.append ((data[:4], data[8:8+length]))
+		data = data[8+length:]
+	return chunks
+
+class SMFRecorderTest (unittest.TestCase):
+	def setUp (self):
+		self.dir = tempfile.mkdtemp ()
+		self.path = os.path.join (self.dir, "test.mid")
+
+	def tearDown (self):
+		shutil.rmtree (self.dir)
+
+	def testVariableLength (self):
+		for value, encoded in [(0, [0x00]), (0x7F, [0x7F]), (0x80, [0x81, 0x00]),
+				(0x2000, [0xC0, 0x00]), (0x3FFF, [0xFF, 0x7F]), (0x0FFFFFFF, [0xFF, 0xFF, 0xFF, 0x7F])]:
+			self.assertEqual (VariableLength (value), bytearray (encoded))
+
+	def testWrite (self):
+		recorder = SMFRecorder (self.path, division=960) # 1920 ticks a second at 120 bpm
+		recorder.start = 10.0
+		recorder.Put ([0x91, 60, 100], 10.5)
+		recorder.Put ([0x90, 64, 90], 11.0)
+		recorder.Put ([0xF8], 11.0)
+		recorder.Put ([0x91, 60, 0], 11.0)
+		self.assertTrue (recorder.Drain ())
+		self.assertFalse (recorder.Drain ())
+		recorder.Write ()
+		chunks = ReadChunks (open (self.path, "rb").read ())
+		self.assertEqual ([chunkType for chunkType, data in chunks], ['MThd'] + ['MTrk'] * 3)
+		self.assertEqual (struct.unpack ('>HHH', chunks[0][1]), (1, 3, 960))
+		self.assertEqual (bytearray (chunks[1][1]),
+			bytearray ([0x00, 0xFF, 0x51, 0x03, 0x07, 0xA1, 0x20, 0x00, 0xFF, 0x2F, 0x00]))
+		endOfTrack = bytearray ([0x00, 0xFF, 0x2F, 0x00])
+		self.assertEqual (bytearray (chunks[2][1]),
+			bytearray ([0x00, 0xFF, 0x03, 9]) + bytearray ("Channel 1") +
+			bytearray ([0x8F, 0x00, 0x90, 64, 90]) + endOfTrack) # 1920 ticks
+		self.assertEqual (bytearray (chunks[3][1]),
+			bytearray ([0x00, 0xFF, 0x03, 9]) + bytearray ("Channel 2") +
+			bytearray ([0x87, 0x40, 0x91, 60, 100, 0x87, 0x40, 0x91, 60, 0]) + endOfTrack) # 960, 960
+
+if __name__ == '__main__':
+	unittest.main ()
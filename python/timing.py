@@ -0,0 +1,44 @@
+''' timing.py - Clocks that drive the main loop.
+'''
+
+import time
+
+class FrameTimer:
+	def __init__ (self):
+		self.nFrame = 0
+		self.fps = 0
+		self.countStart = time.time ()
+		self.lastFrame = self.countStart
+		self.tickTime = 0.001 # Avoids divide-by-zero errors
+
+	def Tick (self):
+		self.nFrame += 1
+		now = time.time ()
+		self.tickTime = now - self.lastFrame
+		self.lastFrame = now
+		
+		# Recalculate FPS after every 30 frames
+		if self.nFrame >= 30:
+			elapsed = now - self.countStart
+			self.fps = float(self.nFrame)/elapsed
+			self.countStart = time.time ()
+			self.nFrame = 0
+
+class ReplayClock:
+	''' Stands in for FrameTimer when replaying recorded video. Each tick
+	advances a virtual clock by exactly one frame interval, so the tracker
+	sees the same timing on every run regardless of how fast frames are
+	processed. fps reports the real processing rate. '''
+	def __init__ (self, frameRate):
+		self.frameRate = frameRate
+		self.tickTime = 1.0/frameRate
+		self.now = 0.0
+		self.nFrame = 0
+		self.fps = 0
+		self.startTime = time.time ()
+
+	def Tick (self):
+		self.nFrame += 1
+		self.now = self.nFrame * self.tickTime
+		elapsed = time.time () - self.startTime
+		if elapsed > 0: self.fps = self.nFrame/elapsed
@@ -1,6 +1,9 @@
 import cv
-import math
+import copy, math, heapq
+from bisect import bisect_left, bisect_right
+import numpy as np
 from music import *
+from profiling import Now
 
 from config import *
 
@@ -21,9 +24,185 @@ class String:
 		self.x = x
 		self.noteOffset = noteOffset
 		self.activeNotes = []
-		self.remainingNoteTime = [] # Parallel list to activeNotes containing note trigger times.
+		self.expiries = [] # Parallel list to activeNotes containing NoteTimer entries, or None for notes without one.
 
-class Marker:
+class NoteTimer:
+	''' Release times of AUTORELEASE notes across all of a tracker's markers,
+	in a heap, so that each tick only touches notes that have expired.
+
+	Times are on the tracker's own clock, the sum of the tick times it has
+	been given, so note lengths follow the replay clock when there is one.
+	Entries for notes released early are marked dead and dropped when they
+	reach the top of the heap. '''
+	def __init__ (self):
+		self.now = 0.0
+		self.heap = []
+		self.seq = 0
+
+	def Add (self, duration, marker, string, note):
+		''' Schedules note on string to be released by marker.ExpireNote in
+		duration seconds. Returns the entry, for Cancel. '''
+		entry = [self.now + duration, self.seq, marker, string, note]
+		self.seq += 1
+		heapq.heappush (self.heap, entry)
+		return entry
+
+	def Cancel (self, entry):
+		entry[2] = None
+
+	def Advance (self, timeElapsed):
+		self.now += timeElapsed
+		heap = self.heap
+		while len(heap) > 0 and heap[0][0] <= self.now:
+			entry = heapq.heappop (heap)
+			marker = entry[2]
+			if marker != None: marker.ExpireNote (entry)
+
+def MatchBlobs (markers, blobs, frameTime=None):
+	''' Matches detected blobs, given as (x, y) positions in a frame captured
+	at frameTime, to a group of markers of the same colour. Visible markers take their nearest blob,
+	closest pairs first; leftover blobs go to hidden markers and markers
+	left without a blob are disabled. '''
+	pairs = []
+	for m, marker in enumerate (markers):
+		if not marker.visible: continue
+		for b, (x, y) in enumerate (blobs):
+			pairs.append (((marker.tX-x)**2 + (marker.tY-y)**2, m, b))
+	pairs.sort ()
+	markerBlob = [None] * len(markers)
+	blobTaken = [False] * len(blobs)
+	for distance, m, b in pairs:
+		if markerBlob[m] != None or blobTaken[b]: continue
+		markerBlob[m] = b
+		blobTaken[b] = True
+	freeBlobs = [b for b in range (len(blobs)) if not blobTaken[b]]
+	for m, marker in enumerate (markers):
+		if markerBlob[m] == None and not marker.visible and freeBlobs:
+			markerBlob[m] = freeBlobs.pop (0)
+		if markerBlob[m] == None:
+			marker.Disable ()
+		else:
+			x, y = blobs[markerBlob[m]]
+			marker.Target (x, y, frameTime)
+
+class AlphaBetaFilter:
+	''' Smooths a marker's track with fixed gains: each measurement corrects
+	the predicted position by alpha times the residual and the velocity by
+	beta times the residual over the time step. '''
+	def __init__ (self, alpha=MOTION_FILTER_ALPHA, beta=MOTION_FILTER_BETA):
+		self.alpha = alpha
+		self.beta = beta
+		self.Clear ()
+
+	def Clear (self):
+		''' Forgets the track, e.g.: when the marker reappears. '''
+		self.initialised = False
+		self.lastTime = None
+
+	def Update (self, x, y, t, timeElapsed):
+		''' Takes a measured position, seen at capture time t if known, and
+		returns the smoothed (x, y, vx, vy). '''
+		if not self.initialised:
+			self.x, self.y, self.vx, self.vy = x, y, 0.0, 0.0
+			self.lastTime = t
+			self.initialised = True
+			return (self.x, self.y, self.vx, self.vy)
+		dt = TimeStep (self.lastTime, t, timeElapsed)
+		if dt == None: return (self.x, self.y, self.vx, self.vy) # Not a new frame
+		self.lastTime = t
+		px, py = self.Predict (dt)
+		rx = x - px
+		ry = y - py
+		self.x = px + self.alpha*rx
+		self.y = py + self.alpha*ry
+		self.vx += self.beta*rx/dt
+		self.vy += self.beta*ry/dt
+		return (self.x, self.y, self.vx, self.vy)
+
+	def Predict (self, dt):
+		''' Returns the position expected dt seconds after the last update. '''
+		return (self.x + self.vx*dt, self.y + self.vy*dt)
+
+class KalmanFilter:
+	''' A constant-velocity Kalman filter, run independently on each axis.
+	Unlike the alpha-beta filter, the gains adapt to the time step and to
+	how settled the track is, so it follows a marker closely when it first
+	appears and smooths more as the estimate firms up.
+
+	processNoise is the variance of the acceleration the model allows for,
+	measurementNoise the variance of detected positions. '''
+	def __init__ (self,
+			processNoise=MOTION_FILTER_PROCESS_NOISE,
+			measurementNoise=MOTION_FILTER_MEASUREMENT_NOISE,
+			velocityVariance=1.0):
+		self.q = processNoise
+		self.r = measurementNoise
+		self.velocityVariance = velocityVariance
+		self.Clear ()
+
+	def Clear (self):
+		self.initialised = False
+		self.lastTime = None
+
+	def Update (self, x, y, t, timeElapsed):
+		if not self.initialised:
+			# Per axis: [position, velocity, P00, P01, P11], P being the
+			# (symmetric) covariance of the estimate.
+			self.axes = [[x, 0.0, self.r, 0.0, self.velocityVariance],
+				[y, 0.0, self.r, 0.0, self.velocityVariance]]
+			self.lastTime = t
+			self.initialised = True
+		else:
+			dt = TimeStep (self.lastTime, t, timeElapsed)
+			if dt != None:
+				self.lastTime = t
+				self.UpdateAxis (self.axes[0], x, dt)
+				self.UpdateAxis (self.axes[1], y, dt)
+		ax, ay = self.axes
+		return (ax[0], ay[0], ax[1], ay[1])
+
+	def UpdateAxis (self, axis, z, dt):
+		p, v, p00, p01, p11 = axis
+		q = self.q
+		# Predict
+		p += v*dt
+		p00 += dt*(2*p01 + dt*p11) + q*dt**4/4
+		p01 += dt*p11 + q*dt**3/2
+		p11 += q*dt**2
+		# Correct
+		s = p00 + self.r
+		k0 = p00/s
+		k1 = p01/s
+		residual = z - p
+		axis[0] = p + k0*residual
+		axis[1] = v + k1*residual
+		axis[2] = (1 - k0)*p00
+		axis[3] = (1 - k0)*p01
+		axis[4] = p11 - k1*p01
+
+	def Predict (self, dt):
+		ax, ay = self.axes
+		return (ax[0] + ax[1]*dt, ay[0] + ay[1]*dt)
+
+def TimeStep (lastTime, t, timeElapsed):
+	''' The time between two measurements: the difference of their capture
+	times if known, or else the main loop interval. None if t is the same
+	frame as lastTime. '''
+	if t == None or lastTime == None: return timeElapsed
+	if t <= lastTime: return None
+	return t - lastTime
+
+MOTION_FILTERS = {
+	"alphabeta": AlphaBetaFilter,
+	"kalman": KalmanFilter,
+}
+
+def NewMotionFilter (kind=MOTION_FILTER):
+	''' Returns a new motion filter of the kind named, or None for none. '''
+	if kind == None: return None
+	return MOTION_FILTERS[kind] ()
+
+class Marker (object):
 	''' An object with a position in a unit square.
 	'''
 
@@ -34,6 +213,7 @@ class Marker:
 	MODE_MONOPHONIC = 1
 
 	nMarkers = 0
+	stored = False # True for markers whose state lives in a MarkerStore
 	def __init__ (self,
 			name="Marker",
 			x=0,
@@ -46,16 +226,23 @@ class Marker:
 		self.name = name
 		self.x = x # Position
 		self.y = y
+		self.pX = x # Position before the last tick
 		self.tX = x # Target position
 		self.tY = y
+		self.time = None # Capture times of the frames the position and target came from
+		self.pTime = None # Capture time of pX
+		self.tTime = None
 		self.vx = 0.0 # Velocity
 		self.vy = 0.0
+		self.velocity = 0.0
 		self.visible = False
 		self.justAppeared = True
 		self.colour = colour
 		self.midiOut = midiOut
 		self.colourRange = colourRange
 		self.stringOffset = stringOffset
+		self.noteTimer = None # Set by the tracker
+		self.motionFilter = NewMotionFilter ()
 		if ID == None:
 			self.ID = Marker.nMarkers
 			Marker.nMarkers += 1
@@ -65,30 +252,80 @@ class Marker:
 	def Enable (self):
 		self.visible = True
 		self.justAppeared = True
+		if self.motionFilter != None: self.motionFilter.Clear ()
 
 	def Disable (self):
 		self.visible = False
 
 	def Tick (self, timeElapsed):
+		# The store moves every marker at once.
+		if not self.stored: self.Move (timeElapsed)
+		if self.motionFilter != None and self.visible: self.Filter (timeElapsed)
+
+	def Filter (self, timeElapsed):
+		''' Replaces the raw position and velocity with the filtered ones. '''
+		self.x, self.y, self.vx, self.vy = self.motionFilter.Update (
+			self.x, self.y, self.time, timeElapsed)
+		self.velocity = math.sqrt (self.vx**2 + self.vy**2)
+
+	def Move (self, timeElapsed):
+		''' Moves the marker to its target, working out its velocity. '''
+		self.pX = self.tX if self.justAppeared else self.x
+		self.pTime = self.tTime if self.justAppeared else self.time
 		if self.justAppeared:
 			self.vx = self.vy = self.velocity = 0
 			self.x = self.tX
 			self.y = self.tY
+			self.time = self.tTime
 			self.justAppeared = False
 			return
+		# Nothing to do if the target is from the frame the marker's already
+		# at, e.g.: the main loop ticked without a new frame.
+		if self.tTime != None and self.tTime == self.time: return
+		# Velocity over the time between the frames the positions were seen
+		# in, if known, rather than between ticks of the main loop.
+		if self.tTime != None and self.time != None and self.tTime > self.time:
+			timeElapsed = self.tTime - self.time
 		self.vx = (self.tX - self.x)/timeElapsed
 		self.vy = (self.tY - self.y)/timeElapsed
 		self.velocity = math.sqrt (self.vx**2 + self.vy**2)
 		self.x = self.tX
 		self.y = self.tY
+		self.time = self.tTime
 
-	def Target (self, x, y):
+	def PredictPosition (self, dt):
+		''' Returns where the marker is expected to be dt seconds after it was
+		last seen, for the detector to search around. '''
+		if self.motionFilter != None and self.motionFilter.initialised:
+			return self.motionFilter.Predict (dt)
+		return (self.tX + self.vx*dt, self.tY + self.vy*dt)
+
+	def Target (self, x, y, t=None):
+		''' Sets the position the marker was seen at in a frame captured at
+		time t (see profiling.Now), if known. '''
 		if not self.visible:
 			self.Enable ()
 		self.tX = x
 		self.tY = y
+		self.tTime = t
 
 class CVMarker (Marker):
+	'''
+	A marker whose position is sent continuously as MIDI. Each axis has its
+	own output mode:
+
+	CC (default): A 7-bit value on a continuous controller.
+
+	CC 14-bit: A 14-bit value sent as a controller pair, the MSB on the
+		given controller (0-31) and the LSB on controller+32.
+
+	Pitch bend: A 14-bit pitch bend on the axis' channel. A channel has
+		only one, so both axes can't use it on the same channel.
+	'''
+	MODE_CC = 0
+	MODE_CC_14BIT = 1
+	MODE_PITCH_BEND = 2
+
 	typeID = Marker.TYPE_CV
 	def __init__ (self,
 			name="CVMarker",
@@ -102,6 +339,8 @@ class CVMarker (Marker):
 			yChannel=1,
 			xRange=(0,127),
 			yRange=(0,127),
+			xMode=None,
+			yMode=None,
 			colourRange=None,
 			stringOffset=0.5,
 			ID = None):
@@ -120,15 +359,45 @@ class CVMarker (Marker):
 		self.yRange = yRange
 		self.xChannel = xChannel
 		self.yChannel = yChannel
+		# Modes not given are the config defaults, except that y falls back to
+		# a controller rather than share x's pitch bend, e.g.: for markers
+		# made in the UI.
+		if xMode == None: xMode = MARKER_CV_DEFAULT_X_MODE
+		if yMode == None:
+			yMode = MARKER_CV_DEFAULT_Y_MODE
+			if CVMarker.AxesClash (xChannel, yChannel, xMode, yMode, xController, yController):
+				yMode = CVMarker.MODE_CC
+		# Axes sending to the same value would overwrite each other.
+		if CVMarker.AxesClash (xChannel, yChannel, xMode, yMode, xController, yController):
+			raise ValueError ("%s: both axes send to the same value on channel %i" % (name, xChannel+1))
+		self.xMode = xMode
+		self.yMode = yMode
+
+	@staticmethod
+	def AxesClash (xChannel, yChannel, xMode, yMode, xController, yController):
+		''' True if both axes would send to the same value. '''
+		if xChannel != yChannel: return False
+		if (xMode == CVMarker.MODE_PITCH_BEND) != (yMode == CVMarker.MODE_PITCH_BEND): return False
+		return xMode == CVMarker.MODE_PITCH_BEND or xController == yController
 
 	def Tick (self, timeElapsed):
 		Marker.Tick (self, timeElapsed)
 		if not self.visible: return
 		# Generate MIDI output
-		mX = int(self.x*127)
-		mY = int(self.y*127)
-		self.midiOut.SendControl (mX,controller=self.xController,channel=self.xChannel+1)
-		self.midiOut.SendControl (mY,controller=self.yController,channel=self.yChannel+1)
+		self.SendPosition ()
+
+	def SendPosition (self, x=True, y=True):
+		if x: self.SendAxis (self.x, self.xMode, self.xController, self.xChannel+1)
+		if y: self.SendAxis (self.y, self.yMode, self.yController, self.yChannel+1)
+
+	def SendAxis (self, position, mode, controller, channel):
+		position = max (0.0, min (position, 1.0))
+		if mode == CVMarker.MODE_CC_14BIT:
+			self.midiOut.SetControl14 (int(position*16383),controller=controller,channel=channel)
+		elif mode == CVMarker.MODE_PITCH_BEND:
+			self.midiOut.SetPitchBend (int(position*16383),channel=channel)
+		else:
+			self.midiOut.SetControl (int(position*127),controller=controller,channel=channel)
 
 class NoteMarker (Marker):
 	'''
@@ -198,7 +467,14 @@ class NoteMarker (Marker):
 
 	def SetTuning (self, tuning):
 		self.tuning = tuning
-		self.strings = self.GenerateStrings (self.stringOffset,tuning)
+		self.SetStrings (self.GenerateStrings (self.stringOffset,tuning))
+
+	def SetStrings (self, strings):
+		''' Strings are kept in order of position, with the positions in a
+		separate list to bisect. '''
+		self.strings = sorted (strings, key=lambda string: string.x)
+		self.stringPositions = [string.x for string in self.strings]
+		if self.stored: self.store.stringsChanged = True
 
 	def Disable (self):
 		''' The marker was not found in the processed image. '''
@@ -207,62 +483,84 @@ class NoteMarker (Marker):
 	
 	def Tick (self, timeElapsed):
 		''' Marker heartbeat function. '''
-		# Determine which strings have been plucked, if any.
-		pluckedStrings = []
-		for i, string in enumerate (self.strings):
-			if not self.justAppeared:
-				crossedLeft = (self.tX < string.x and self.x > string.x)
-				crossedRight = (self.tX > string.x and self.x < string.x)
-				if crossedLeft or crossedRight:
-					pluckedStrings.append (i)
-
-		# Only now do we let the parent class update the marker's position. 
+		# Let the parent class update the marker's position; pX keeps the
+		# old one.
 		Marker.Tick (self, timeElapsed)
-		
-		if self.mode == NoteMarker.MODE_AUTORELEASE:
-			# Check if there are any active notes ready to be turned off.
-			for string in self.strings:
-				if len(string.activeNotes) == 0: continue
-				for i in range(len(string.activeNotes)):
-					string.remainingNoteTime[i] -= timeElapsed
-				while len(string.activeNotes)>0 and string.remainingNoteTime[0] <= 0:
-					# Send note-off and remove from active notes.
-					self.midiOut.NoteOff (string.activeNotes[0],0x90 + self.channel)
-					string.remainingNoteTime.pop (0)
-					string.activeNotes.pop (0)
-		
-		# Only continue if the marker is visible and a string has been plucked.
-		if not self.visible or len(pluckedStrings) == 0: return
-	
-		# Handle plucked strings
+
+		# Only continue if the marker is visible and has moved.
+		if not self.visible or self.pX == self.x: return
+
+		# Determine which strings have been plucked, if any: those lying
+		# strictly between the old and new x.
+		left = min (self.pX, self.x)
+		right = max (self.pX, self.x)
+		self.Pluck (range (
+			bisect_right (self.stringPositions, left),
+			bisect_left (self.stringPositions, right)))
+
+	def Pluck (self, pluckedStrings):
+		''' Plays the strings with the given indices, crossed since the last
+		tick. '''
 		for stringIndex in pluckedStrings:
 			string = self.strings[stringIndex]
+			at = self.CrossingTime (string.x)
 			if len(string.activeNotes) > 0:
 				if self.mode == NoteMarker.MODE_TOGGLE:
 					# Toggle mode: If the string is already activated, deactive it.
-					self.midiOut.NoteOff (string.activeNotes[0],0x90 + self.channel)
-					string.activeNotes = []
+					self.midiOut.NoteOff (string.activeNotes[0],0x90 + self.channel, at=at)
+					self.ClearString (string)
 					continue
 				elif not self.polyphonic:
 					# Not polyphonic: mute active notes on this string.
-					for note in string.activeNotes: self.midiOut.NoteOff (note, 0x90 + self.channel)
-					string.activeNotes = []
-					string.remainingNoteTime = []
+					for note in string.activeNotes: self.midiOut.NoteOff (note, 0x90 + self.channel, at=at)
+					self.ClearString (string)
 
 			# Determine note from y position and string offset.
 			note = self.GetNote (self.scale.GetNote (self.y) + string.noteOffset)
 			string.activeNotes.append (note)
-			if self.mode == NoteMarker.MODE_AUTORELEASE:
-				string.remainingNoteTime.append (self.duration)
+			if self.mode == NoteMarker.MODE_AUTORELEASE and self.noteTimer != None:
+				string.expiries.append (self.noteTimer.Add (self.duration, self, string, note))
+			else:
+				string.expiries.append (None)
 			velocity = max (64, min (self.velocity*64,127))
-			self.midiOut.NoteOn (note, velocity, channel=0x90 + self.channel)
+			self.midiOut.NoteOn (note, velocity, channel=0x90 + self.channel, at=at)
+			if self.mode == NoteMarker.MODE_AUTORELEASE and self.midiOut.scheduler != None:
+				start = at if at != None else Now ()
+				self.midiOut.NoteOff (note, 0x90 + self.channel, at=start + self.duration)
+
+	def CrossingTime (self, position):
+		''' Returns when to play a string at position crossed since the last
+		tick: the instant the marker passed it, interpolated between the
+		capture times of the two frames, delayed by NOTE_CROSSING_DELAY. None
+		(play now) if the capture times aren't known or timing is off. '''
+		if NOTE_CROSSING_DELAY == None: return None
+		if self.pTime == None or self.time == None or self.time <= self.pTime: return None
+		fraction = (position - self.pX)/(self.x - self.pX)
+		return self.pTime + fraction*(self.time - self.pTime) + NOTE_CROSSING_DELAY
 
 	def MuteActiveNotes (self):
 		''' Sends note-off messages for all active notes on all strings for this marker. '''
 		for string in self.strings:
 			for note in string.activeNotes: self.midiOut.NoteOff (note, 0x90 + self.channel)
-			string.activeNotes = []
-			string.remainingNoteTime = []
+			self.ClearString (string)
+
+	def ClearString (self, string):
+		''' Forgets the active notes on a string, and their release times. '''
+		for entry in string.expiries:
+			if entry != None: self.noteTimer.Cancel (entry)
+		string.activeNotes = []
+		string.expiries = []
+
+	def ExpireNote (self, entry):
+		''' Called by the note timer when an AUTORELEASE note is due. '''
+		string = entry[3]
+		i = string.expiries.index (entry)
+		# Send note-off, unless the output scheduler already has, and remove
+		# from active notes.
+		if self.midiOut.scheduler == None:
+			self.midiOut.NoteOff (string.activeNotes[i],0x90 + self.channel)
+		string.activeNotes.pop (i)
+		string.expiries.pop (i)
 
 	def GenerateStrings (self, centre, offsetPattern, spacing=0.05):
 		n = len (offsetPattern)
@@ -281,9 +579,250 @@ class NoteMarker (Marker):
 		if not semitones == None:
 			self.transposeSemitones = semitones
 
+class MarkerStore:
+	''' Holds the state of a tracker's markers as structure of arrays, so
+	that Tick updates every marker in a few vectorised steps rather than one
+	Marker.Tick at a time.
+
+	Tick moves all markers at once, finds every NoteMarker's plucked strings
+	with one search over the strings of all of them, and quantises every
+	CVMarker's position together. Python code then only runs for markers
+	that have something to do: those with a motion filter, those that
+	crossed strings and those whose output value changed.
+
+	Slots are laid out by kind of marker, NoteMarkers first and then
+	CVMarkers, so each kind's state is a slice of the arrays. Bound markers
+	are switched to a subclass, with no instance dict of its own, whose
+	fields are properties onto the marker's slot, so code using the Marker
+	attributes works unchanged. Capture times of None are stored as NaN.
+	'''
+	# Each field is a row of one array, ordered so that the fields updated
+	# together are adjacent rows: (y, x, time) from (tY, tX, tTime), and
+	# (pX, pTime) from (x, time).
+	FIELDS = ['y', 'x', 'time', 'tY', 'tX', 'tTime', 'vy', 'vx', 'pX', 'pTime', 'velocity']
+	FLAGS = ['visible', 'justAppeared']
+	# CVMarker settings that invalidate the store's record of values sent
+	OUTPUT_SETTINGS = ['xMode', 'yMode', 'xController', 'yController', 'xChannel', 'yChannel']
+	CV_RESOLUTION = 16383 # Finest output value: 14-bit. 7-bit CC values are this over 129.
+	storedClasses = {}
+
+	def __init__ (self, midiOut=None):
+		self.midiOut = midiOut
+		self.controls = None # midiOut's controller cache the sent values went to
+		self.markers = [] # In the tracker's order
+		self.slots = [] # In slot order
+		self.Allocate (0)
+
+	def Allocate (self, nMarkers):
+		self.fields = np.zeros ((len(MarkerStore.FIELDS), nMarkers))
+		self.flags = np.zeros ((len(MarkerStore.FLAGS), nMarkers), dtype=bool)
+		for i, name in enumerate (MarkerStore.FIELDS): setattr (self, name, self.fields[i])
+		for i, name in enumerate (MarkerStore.FLAGS): setattr (self, name, self.flags[i])
+		self.current = self.fields[0:3]
+		self.position = self.fields[0:2]
+		self.targets = self.fields[3:6]
+		self.targetPosition = self.fields[3:5]
+		self.velocities = self.fields[6:8]
+		self.previous = self.fields[8:10]
+		# Quantised CV (y, x) last sent by each slot, -1 for none.
+		self.sent = np.full ((2, nMarkers), -1.0)
+
+	def Sync (self, markers, noteTimer):
+		''' Lays out and binds the tracker's markers, if they have changed. '''
+		if self.markers == markers: return
+		# Move every marker's state back into the marker before laying them
+		# out again, so that none is overwritten.
+		for marker in self.slots:
+			if marker.stored and marker.store is self: self.Detach (marker)
+		notes = [marker for marker in markers if isinstance (marker, NoteMarker)]
+		cvs = [marker for marker in markers if isinstance (marker, CVMarker)]
+		# Other kinds of marker tick themselves, motion filter and all.
+		self.others = [marker for marker in markers if not isinstance (marker, (NoteMarker, CVMarker))]
+		self.slots = notes + cvs + self.others
+		self.Allocate (len(self.slots))
+		for slot, marker in enumerate (self.slots):
+			self.Bind (slot, marker)
+			marker.noteTimer = noteTimer
+		self.notes = slice (0, len(notes))
+		self.noteMarkers = notes
+		self.cvs = slice (len(notes), len(notes) + len(cvs))
+		self.cvMarkers = cvs
+		self.filtered = [marker for marker in notes + cvs if marker.motionFilter != None]
+		# Where each slot's marker is in the tracker's list, to act in the
+		# same order as without a store.
+		index = dict ((id (marker), i) for i, marker in enumerate (markers))
+		self.order = [index[id (marker)] for marker in self.slots]
+		self.markers = list (markers)
+		self.stringsChanged = True
+
+	def Bind (self, slot, marker):
+		''' Moves marker's state into slot. '''
+		values = [(name, getattr (marker, name)) for name in MarkerStore.FIELDS + MarkerStore.FLAGS]
+		if not marker.stored:
+			marker.__class__ = MarkerStore.StoredClass (marker.__class__)
+			for name, value in values: marker.__dict__.pop (name, None)
+		marker.store = self
+		marker.slot = slot
+		for name, value in values: setattr (marker, name, value)
+
+	def Detach (self, marker):
+		''' Moves marker's state back into the marker itself. '''
+		values = [(name, getattr (marker, name)) for name in MarkerStore.FIELDS + MarkerStore.FLAGS]
+		marker.__class__ = marker.__class__.__bases__[0]
+		marker.store = marker.slot = None
+		for name, value in values: setattr (marker, name, value)
+
+	def IndexStrings (self):
+		''' Lays the string positions of all NoteMarkers end to end, each
+		marker's shifted into a band of its own, for Crossings to search in
+		one go. Marker positions are clipped to a margin of one either side
+		of the strings, which doesn't change the strings between them. '''
+		positions = [marker.stringPositions for marker in self.noteMarkers]
+		allPositions = [x for markerPositions in positions for x in markerPositions]
+		if len(allPositions) > 0:
+			self.stringsLow = min (allPositions) - 1
+			self.stringsHigh = max (allPositions) + 1
+		else:
+			self.stringsLow = self.stringsHigh = 0.0
+		span = self.stringsHigh - self.stringsLow + 1
+		self.stringBase = np.arange (len(positions)) * span - self.stringsLow
+		self.stringKeys = np.concatenate ([np.zeros (0)] +
+			[np.asarray (p, dtype=float) + base for p, base in zip (positions, self.stringBase)])
+		self.stringFirst = np.cumsum ([0] + [len(p) for p in positions[:-1]])
+		self.bounds = np.zeros ((2, len(positions)))
+		self.stringsChanged = False
+
+	def Tick (self, timeElapsed):
+		''' Tracker.Tick for every bound marker. '''
+		self.Move (timeElapsed)
+		for marker in self.filtered:
+			if marker.visible: marker.Filter (timeElapsed)
+		actions = [(self.order[marker.slot], marker.Tick, (timeElapsed,)) for marker in self.others]
+		if len(self.noteMarkers) > 0: actions += self.Crossings ()
+		if len(self.cvMarkers) > 0: actions += self.PositionChanges ()
+		# Markers act in the order they're ticked in without a store.
+		actions.sort ()
+		for order, action, args in actions: action (*args)
+
+	def Move (self, timeElapsed):
+		''' Marker.Move for every marker at once. '''
+		appeared = self.justAppeared
+		# Markers that have just appeared start at their target, and so have
+		# no velocity.
+		np.copyto (self.current, self.targets, where=appeared)
+		np.copyto (self.previous, self.fields[1:3])
+		# Velocity over the time between the frames the positions were seen
+		# in, if known. The difference is NaN where either time isn't.
+		frameTime = self.tTime - self.time
+		known = np.isfinite (frameTime)
+		# Markers whose target is from the frame they're already at keep
+		# their velocity.
+		moving = frameTime != 0
+		moving |= appeared
+		np.greater (frameTime, 0, out=known, where=known)
+		delta = self.targetPosition - self.position
+		np.divide (delta, np.where (known, frameTime, timeElapsed), out=self.velocities, where=moving)
+		np.hypot (self.vx, self.vy, out=self.velocity, where=moving)
+		np.copyto (self.current, self.targets)
+		appeared[:] = False
+
+	def Crossings (self):
+		''' NoteMarker.Tick's string crossings for every NoteMarker. Returns
+		(order, Pluck, (strings,)) for those that crossed any. '''
+		if self.stringsChanged: self.IndexStrings ()
+		pX = self.pX[self.notes]
+		x = self.x[self.notes]
+		bounds = self.bounds
+		np.minimum (pX, x, bounds[0])
+		np.maximum (pX, x, bounds[1])
+		np.clip (bounds, self.stringsLow, self.stringsHigh, bounds)
+		bounds += self.stringBase
+		start = np.searchsorted (self.stringKeys, bounds[0], 'right')
+		end = np.searchsorted (self.stringKeys, bounds[1], 'left')
+		crossed = end > start
+		crossed &= self.visible[self.notes]
+		if not crossed.any (): return []
+		actions = []
+		for j in np.flatnonzero (crossed):
+			first = self.stringFirst[j]
+			marker = self.noteMarkers[j]
+			actions.append ((self.order[j], marker.Pluck, (range (start[j] - first, end[j] - first),)))
+		return actions
+
+	def PositionChanges (self):
+		''' CVMarker.Tick's output for every CVMarker whose position has
+		changed at the finest resolution sent. Returns (order, SendPosition,
+		(x, y)) for those, x and y saying which axes to send. '''
+		controls = self.midiOut.controls if self.midiOut != None else None
+		if controls is not self.controls:
+			# The device has forgotten what it sent, e.g.: on reconnecting.
+			self.controls = controls
+			self.sent[:] = -1
+		values = np.clip (self.position[:,self.cvs], 0.0, 1.0)
+		values *= MarkerStore.CV_RESOLUTION
+		np.trunc (values, values)
+		sent = self.sent[:,self.cvs]
+		changed = values != sent
+		changed &= self.visible[self.cvs]
+		if not changed.any (): return []
+		np.copyto (sent, values, where=changed)
+		first = self.cvs.start
+		return [(self.order[first + j], self.cvMarkers[j].SendPosition, (changed[1,j], changed[0,j]))
+			for j in np.flatnonzero (changed[0] | changed[1])]
+
+	@staticmethod
+	def StoredClass (cls):
+		stored = MarkerStore.storedClasses.get (cls)
+		if stored == None:
+			attributes = {'__slots__': (), 'stored': True, 'Target': StoredTarget}
+			for name in MarkerStore.FIELDS: attributes[name] = StoredField (name)
+			for name in MarkerStore.FLAGS: attributes[name] = StoredFlag (name)
+			if issubclass (cls, CVMarker):
+				for name in MarkerStore.OUTPUT_SETTINGS: attributes[name] = OutputSetting (name)
+			stored = MarkerStore.storedClasses[cls] = type ("Stored" + cls.__name__, (cls,), attributes)
+		return stored
+
+def StoredField (name):
+	def Get (marker):
+		value = getattr (marker.store, name).item (marker.slot)
+		if value != value: return None # NaN
+		return value
+	def Set (marker, value):
+		getattr (marker.store, name)[marker.slot] = value if value != None else np.nan
+	return property (Get, Set)
+
+def StoredFlag (name):
+	def Get (marker):
+		return getattr (marker.store, name).item (marker.slot)
+	def Set (marker, value):
+		getattr (marker.store, name)[marker.slot] = value
+	return property (Get, Set)
+
+def OutputSetting (name):
+	''' A CVMarker setting kept in the marker, which makes the store resend
+	the marker's position when it changes. '''
+	def Get (marker):
+		return marker.__dict__[name]
+	def Set (marker, value):
+		marker.__dict__[name] = value
+		marker.store.sent[:,marker.slot] = -1
+	return property (Get, Set)
+
+def StoredTarget (marker, x, y, t=None):
+	''' Marker.Target, writing straight to the store's arrays: it's called
+	for every marker every frame. '''
+	store = marker.store
+	slot = marker.slot
+	if not store.visible[slot]: marker.Enable ()
+	store.tX[slot] = x
+	store.tY[slot] = y
+	store.tTime[slot] = t if t != None else np.nan
+
 class Tracker:
 	def __init__ (self, midiOut):
 		self.midiOut = midiOut
+		self.noteTimer = NoteTimer ()
+		self.store = MarkerStore (midiOut) if TRACKER_ARRAY_STORE else None
 
 		self.featureFrame = cv.CreateImage (GRID_SIZE, 8, 3)
 		self.featureDisplayFrame = cv.CreateImage (STREAM_SIZE, 8, 3)
@@ -338,9 +877,42 @@ class Tracker:
 			stringOffset=0.45,
 			yChannel=4))
 
+		# Extra markers for colours tracked more than once
+		for i, marker in enumerate (self.markers[:]):
+			for n in range (MARKER_INSTANCES[i] - 1):
+				self.markers.append (self.CloneMarker (marker, n+2))
+
+	def CloneMarker (self, marker, instance):
+		''' Makes another marker of the same colour and type. The clone shares
+		the original's colour range, which is how the stream processor knows
+		to detect them together. '''
+		clone = copy.copy (marker)
+		if clone.stored: clone.store.Detach (clone) # Don't share the original's slot
+		clone.motionFilter = NewMotionFilter ()
+		clone.name = "%s %i" % (marker.name, instance)
+		clone.ID = Marker.nMarkers
+		Marker.nMarkers += 1
+		clone.visible = False
+		clone.justAppeared = True
+		if isinstance (clone, NoteMarker):
+			clone.SetTuning (clone.tuning) # Fresh strings with no active notes
+		return clone
+
+	def AssignBlobs (self, markers, blobs, frameTime=None):
+		MatchBlobs (markers, blobs, frameTime)
+
 	def Tick (self, timeElapsed):
+		# Release notes that are due, then let markers pluck new ones.
+		self.noteTimer.Advance (timeElapsed)
+		if self.store != None:
+			# Markers may have been swapped in from elsewhere, e.g.: the UI.
+			self.store.Sync (self.markers, self.noteTimer)
+			self.store.Tick (timeElapsed)
+			return
 		visibleMarkers = []
 		for i, marker in enumerate(self.markers):
+			# Markers may have been swapped in from elsewhere, e.g.: the UI.
+			marker.noteTimer = self.noteTimer
 			# Update marker positions
 			marker.Tick (timeElapsed)
 			if not marker.visible: continue
@@ -13,6 +13,7 @@ from tracker import Marker, NoteMarker, CVMarker
 from music import *
 from CVGLImage import CVGLImage
 from MIDIio import MIDIDevice
+from profiling import profiler
 from constants import *
 from config import *
 
@@ -159,7 +160,8 @@ class MainWindow:
 
 		glColor4f (1.0,1.0,1.0,1.0)
 		if self.streamProcessor.capture:
-			self.LoadVideoTextures ()
+			with profiler.Span ("render.upload"):
+				self.LoadVideoTextures ()
 			self.DrawVideoStream ()
 	
 		#glBindTexture (GL_TEXTURE_2D, self.uiTexture)
@@ -169,6 +171,8 @@ class MainWindow:
 		self.DrawStrings ()
 		
 		self.DrawFPS ()
+		if profiler.enabled and self.trackerConfigurationWindow.visible:
+			self.DrawProfile ()
 		
 		for item in self.items:
 			if not item.visible: continue
@@ -189,6 +193,21 @@ class MainWindow:
 		self.fonts[FONT_SMALL].Render ("FPS: %i" % self.scheduler.frameTimer.fps)
 		glPopMatrix()
 
+	def DrawProfile (self):
+		''' Shows per-stage timings from the profiler, in milliseconds. '''
+		glColor4f (*UI_HUD_TEXT_COLOUR)
+		x = DISPLAY_SIZE[0] - UI_PROFILE_WIDTH
+		y = DISPLAY_SIZE[1] - 3*UI_TABLE_ROW_HEIGHT
+		lines = ["%-16s %6s %6s %6s" % ("Stage", "min", "mean", "p99")]
+		for name, least, mean, p99, n in profiler.GetSummary ():
+			lines.append ("%-16s %6.2f %6.2f %6.2f" % (name, least, mean, p99))
+		for line in lines:
+			glPushMatrix ()
+			glTranslatef (x, y, 0.0)
+			self.fonts[FONT_SMALL].Render (line)
+			glPopMatrix ()
+			y -= UI_TABLE_ROW_HEIGHT
+
 	def LoadVideoTextures (self):
 		# Raw frame data is expected to be in OpenCV's default of BGR 8UC3. 
 		#frame = self.streamProcessor.GetRawFrame ()
@@ -330,7 +349,7 @@ class MIDIConfigurationWindow (BasicFrame):
 		self.inputSelector = SelectionGroup (
 			label = "MIDI Input",
 			window = window,
-			options=enumerate(midiIn.inPorts),
+			options=enumerate(midiIn.GetInputPorts ()),
 			default=midiIn.deviceID,
 			bounds=Rect(bounds.x,bounds.y,UI_MIDI_DEVICE_BUTTON_WIDTH,0),
 			onSelect=self.OnSelectInputDevice,
@@ -338,7 +357,7 @@ class MIDIConfigurationWindow (BasicFrame):
 		self.outputSelector = SelectionGroup (
 			label = "MIDI Output",
 			window = window,
-			options=enumerate(midiOut.outPorts),
+			options=enumerate(midiOut.GetOutputPorts ()),
 			default=midiOut.deviceID,
 			bounds=Rect(self.inputSelector.bounds.xMax,bounds.y,UI_MIDI_DEVICE_BUTTON_WIDTH,0),
 			onSelect=self.OnSelectOutputDevice,